@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+
+# Benchmarks of the set operations and of tsetop, run as: python bench_setop.py [--save <json>] [--compare <json>]
+# Each benchmark records its best wall time out of --repeat runs, its throughput (items of all inputs per second) and
+# its peak memory: that allocated by Python during a separate run (by tracemalloc, the inputs excluded) for the
+# classes, the peak RSS for tsetop. --compare flags benchmarks slower or larger than in a baseline saved by --save by
+# more than --tolerance, and exits with status 1 if there are any.
+
+import argparse
+import gzip
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import setop
+from setop import *
+
+
+TSETOP  = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tsetop')
+results = {}    # name -> {'seconds': ..., 'items_per_second': ..., 'peak_memory': ...}
+options = argparse.Namespace(repeat = 3, memory = True, filter = None)
+
+
+# Synthetic data
+
+def tsvLines(n, fields = 5, seed = 0):
+    # n unique tab-separated lines, the i-th field of each line is unique as well
+    rnd = random.Random(seed)
+    ids = rnd.sample(range(10 * n), n)
+    return ['\t'.join('f%i_%i'%(i, x) for i in range(fields)) + '\n' for x in ids]
+
+def zipfKeys(n, distinct, s = 1.2, seed = 0):
+    # n keys out of distinct ones, the i-th most frequent with the probability ~ 1/i**s
+    rnd     = random.Random(seed)
+    weights = [1 / i ** s for i in range(1, distinct + 1)]
+    return ['k%i'%i for i in rnd.choices(range(distinct), weights, k = n)]
+
+def idLines(ids, length = 16):
+    # lines of about length characters, an id and padding (the same for equal ids)
+    pad = 'x' * max(length - 10, 1)
+    return ['%i\t%s\n'%(i, pad) for i in ids]
+
+def dataset(n, hits = 0.5, multiset = False, skew = None, length = 16, seed = 0):
+    # lines of a and b, n of each, about the fraction hits of the items of a found in b; multisets draw n/4 distinct
+    # ids with repetition, uniformly or from a Zipf distribution with the exponent skew (the same ids most frequent
+    # in both)
+    rnd = random.Random(seed)
+    h   = int(hits * n)
+    if not multiset:
+        ids = rnd.sample(range(10 * n), 2 * n - h)
+        a   = ids[:n]
+        b   = ids[n - h:]
+        rnd.shuffle(b)
+    else:
+        distinct    = max(n // 4, 1)
+        weights     = [1 / i ** skew for i in range(1, distinct + 1)] if skew else None
+        shift       = int((1 - hits) * distinct)
+        a           = rnd.choices(range(distinct), weights, k = n)
+        b           = [i + shift for i in rnd.choices(range(distinct), weights, k = n)]
+    return idLines(a, length), idLines(b, length)
+
+
+# Measurements
+
+def selected(name):
+    return options.filter is None or options.filter in name
+
+def best(f, repeat = 3):
+    # best wall time of f() out of repeat runs
+    times = []
+    for __ in range(repeat):
+        t = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - t)
+    return min(times)
+
+def report(name, seconds, n, peak = None):
+    results[name] = {'seconds': seconds, 'items_per_second': n / seconds, 'peak_memory': peak}
+    print('%-56s %8.3f s %10.0f items/s %10s'%(
+        name, seconds, n / seconds, '%.1f MiB'%(peak / 2**20) if peak is not None else ''
+        ))
+
+def drain(c):
+    # number of results of an operation (by batches, as tsetop writes them)
+    return sum(map(len, c.iterBatches())) if isinstance(c, SetOp) else sum(1 for __ in c)
+
+def measure(name, f, n):
+    # f() runs a benchmark on n items in this process
+    if not selected(name):
+        return
+    seconds = best(f, options.repeat)
+    peak    = None
+    if options.memory:
+        tracemalloc.start()
+        try:
+            f()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    report(name, seconds, n, peak)
+
+def maxRSS(usage):
+    return usage.ru_maxrss if sys.platform == 'darwin' else 1024 * usage.ru_maxrss     # bytes on macOS, KiB elsewhere
+
+def run(name, command, n):
+    # command (a list of arguments) processing n items, its output discarded
+    if not selected(name):
+        return
+    times   = []
+    peak    = 0
+    for __ in range(options.repeat):
+        t = time.perf_counter()
+        with open(os.devnull, 'wb') as null:
+            p = subprocess.Popen(command, stdout = null)
+        __, status, usage = os.wait4(p.pid, 0)
+        times.append(time.perf_counter() - t)
+        p.returncode = os.waitstatus_to_exitcode(status)
+        if p.returncode:
+            raise subprocess.CalledProcessError(p.returncode, command)
+        peak = max(peak, maxRSS(usage))
+    report(name, min(times), n, peak)
+
+def tsetop(*args):
+    return [sys.executable, TSETOP] + list(args)
+
+
+# Benchmarks of the classes
+
+def benchOps(n = 100000):
+    # every operation on sets and multisets of various hit ratios, skews and line lengths
+    key     = fieldKey(0)
+    data    = (
+        ('set',                 dataset(n)),
+        ('set, 1% hits',        dataset(n, hits = 0.01)),
+        ('set, 99% hits',       dataset(n, hits = 0.99)),
+        ('set, 200 B lines',    dataset(n, length = 200)),
+        ('multiset',            dataset(n, multiset = True)),
+        ('multiset, Zipf 1.1',  dataset(n, multiset = True, skew = 1.1)),
+        )
+    for data_name, (a, b) in data:
+        m       = data_name.startswith('multiset')
+        a_s     = sorted(a)
+        b_s     = sorted(b)
+        index   = SetIndex(b, multiset = m)
+        cases   = [
+            ('SetIntersection',                 lambda: SetIntersection(a, b, m)),
+            ('SetUnion',                        lambda: SetUnion(a, b, m)),
+            ('SetDifference',                   lambda: SetDifference(a, b, m)),
+            ('SetSymmetricDifference',          lambda: SetSymmetricDifference(a, b, m)),
+            ('SetIntersection, key',            lambda: SetIntersection(a, b, m, key, key)),
+            ('SetIntersection, build a',        lambda: SetIntersection(a, b, m, build = 'a')),
+            ('SetIntersection, SetIndex',       lambda: SetIntersection(a, index, m)),
+            ('SetDifference, SetIndex',         lambda: SetDifference(a, index, m)),
+            ('SortedSetIntersection',           lambda: SortedSetIntersection(a_s, b_s, m)),
+            ('SortedSetUnion',                  lambda: SortedSetUnion(a_s, b_s, m)),
+            ('SortedSetDifference',             lambda: SortedSetDifference(a_s, b_s, m)),
+            ('SortedSetSymmetricDifference',    lambda: SortedSetSymmetricDifference(a_s, b_s, m)),
+            ('SpillingSetOp(SetIntersection)',  lambda: SpillingSetOp(SetIntersection, a, b, m, memory_limit = 2**20)),
+            ('ParallelSetOp(SetIntersection)',  lambda: ParallelSetOp(SetIntersection, a, b, m, jobs = 2)),
+            ]
+        if not m:
+            # the joins of multisets may be quadratic in the numbers of equal keys
+            digests = DigestSetIndex(b)
+            bloom   = BloomFilter(b, index = SetIndex(b))
+            cases  += [
+                ('SetJoin, key',                lambda: SetJoin(a, b, m, key, key)),
+                ('SetJoin, key, left',          lambda: SetJoin(a, b, m, key, key, left = True)),
+                ('SetJoin, key, build a',       lambda: SetJoin(a, b, m, key, key, build = 'a')),
+                ('SortedSetJoin, key',          lambda: SortedSetJoin(a_s, b_s, m, key, key)),
+                ('SetIntersection, DigestSetIndex',     lambda: SetIntersection(a, digests)),
+                ('SetIntersection, BloomFilter',        lambda: SetIntersection(a, bloom)),
+                ('SetIntersection, DigestSet check',    lambda: SetIntersection(a, b, unique_check = DigestSet())),
+                ]
+        else:
+            cases  += [
+                ('SetJoin, multiplicity',       lambda: SetJoin(a, b, m, multiplicity = True)),
+                ('SetJoin, key, multiplicity',  lambda: SetJoin(a, b, m, key, key, multiplicity = True)),
+                ]
+        if setop._importNumpy() is not None:
+            cases  += [
+                ('ArraySetOp(SetIntersection), key',    lambda: ArraySetOp(SetIntersection, a, b, m, key, key)),
+                ('ArraySetOp(SetUnion), key',           lambda: ArraySetOp(SetUnion, a, b, m, key, key)),
+                ]
+        for name, op in cases:
+            measure('%s: %s'%(data_name, name), lambda: drain(op()), 2 * n)
+
+def benchBFiles(n = 100000):
+    # chained binary operations vs. the single pass N-ary ones, for 1 to 4 b files sharing half their items with a
+    rnd     = random.Random(3)
+    ids     = rnd.sample(range(20 * n), 3 * n)
+    a       = idLines(ids[:n])
+    for k in (1, 2, 4):
+        bs  = [idLines(rnd.sample(ids[:n], n // 2) + rnd.sample(ids[n:], n - n // 2)) for __ in range(k)]
+        for name, op, nary_op in (
+            ('intersection',    SetIntersection,    NarySetIntersection),
+            ('union',           SetUnion,           NarySetUnion),
+            ):
+            def chained():
+                c = a
+                for b in bs:
+                    c = op(c, b)
+                return c
+            measure('%s, %i b files, chained'%(name, k), lambda: drain(chained()), (k + 1) * n)
+            measure('%s, %i b files, n-ary'%(name, k), lambda: drain(nary_op(a, bs)), (k + 1) * n)
+
+def benchFieldKeys(n = 200000):
+    a = tsvLines(n, seed = 1)
+    b = tsvLines(n, seed = 2)
+    n_ab = len(a) + len(b)
+    line_value = lambda x, y: x if x is not None else y
+    keys = (
+        ('whole line',                      None),
+        ('field 1 (find)',                  fieldKey(0)),
+        ('field 3 (split, limited)',        fieldKey(2)),
+        ('field 3 (split, full)',           lambda x: x.rstrip('\n').split('\t')[2]),
+        ('fields 1,3 (composite)',          fieldKey((0, 2))),
+        )
+    for name, key in keys:
+        measure('intersection, ' + name, lambda: list(SetIntersection(a, b, False, key, key, line_value)), n_ab)
+
+def benchMultisetJoin(n = 100000, distinct = 10000):
+    # about 3M joined pairs, most of them from the few most frequent keys; rates per joined pair
+    a       = zipfKeys(n // 100, distinct, 1.1, seed = 1)
+    b       = zipfKeys(n, distinct, 1.1, seed = 2)
+    pairs   = sum(1 for __ in SetJoin(a, b, True))
+    for name, kwargs in (
+        ('expanded',                    {}),
+        ('expanded, key_b',             {'key_b': str.lower}),
+        ('multiplicity',                {'multiplicity': True}),
+        ('multiplicity, key_b',         {'multiplicity': True, 'key_b': str.lower}),
+        ):
+        measure('multiset join (Zipf), ' + name, lambda: sum(1 for __ in SetJoin(a, b, True, **kwargs)), pairs)
+
+def benchArrays(n = 500000):
+    # hashing vs. sorting in NumPy arrays, for int keys and for lines of numeric ids keyed by their first field
+    if setop._importNumpy() is None:
+        print('arrays: NumPy not installed, skipped')
+        return
+    rnd     = random.Random(1)
+    ints    = (rnd.sample(range(10 ** 12), n), rnd.sample(range(10 ** 12), n))
+    lines   = tuple(['%i\tv\n'%x for x in xs] for xs in ints)
+    key     = fieldKey(0)
+    for name, op in (('intersection', SetIntersection), ('union', SetUnion), ('join', SetJoin)):
+        for items, kwargs in ((ints, {}), (lines, {'key_a': key, 'key_b': key})):
+            kind = ', int keys' if items is ints else ', numeric lines'
+            measure(name + kind,                lambda: drain(op(*items, **kwargs)), 2 * n)
+            measure(name + kind + ', numpy',    lambda: drain(ArraySetOp(op, *items, **kwargs)), 2 * n)
+
+
+# Benchmarks of tsetop
+
+def writeLines(path, lines):
+    with open(path, 'w') as f:
+        f.writelines(lines)
+    return path
+
+def benchCli(n = 100000):
+    # end-to-end runs of tsetop, including the interpreter startup
+    with tempfile.TemporaryDirectory() as directory:
+        path    = lambda name: os.path.join(directory, name)
+        a, b    = dataset(n)
+        am, bm  = dataset(n, multiset = True, skew = 1.1)
+        fa, fb  = writeLines(path('a'), a), writeLines(path('b'), b)
+        fam     = writeLines(path('am'), am)
+        fbm     = writeLines(path('bm'), bm)
+        fas     = writeLines(path('as'), sorted(a))
+        fbs     = writeLines(path('bs'), sorted(b))
+        fb2     = writeLines(path('b2'), dataset(n, seed = 1)[1])
+        for name, args, m in (
+            ('-I',                          ('-I', fa, fb),                                 2),
+            ('-U',                          ('-U', fa, fb),                                 2),
+            ('-D',                          ('-D', fa, fb),                                 2),
+            ('-S',                          ('-S', fa, fb),                                 2),
+            ('-I, 2 B files',               ('-I', fa, fb, fb2),                            3),
+            ('-I -m (Zipf)',                ('-I', '-m', fam, fbm),                         2),
+            ('-D -m (Zipf)',                ('-D', '-m', fam, fbm),                         2),
+            ('-I -f 1',                     ('-f', '1', '1', '-I', fa, fb),                 2),
+            ('-I -b',                       ('-I', '-b', fa, fb),                           2),
+            ('-I -s',                       ('-I', '-s', fas, fbs),                         2),
+            ('-I --build-side a',           ('-I', '--build-side', 'a', fa, fb),            2),
+            ('-I --digests 128',            ('-I', '--digests', '128', fa, fb),             2),
+            ('-I --approximate',            ('-I', '--approximate', fa, fb),                2),
+            ('-I --memory-limit 1M',        ('-I', '--memory-limit', '1M', fa, fb),         2),
+            ('-I -j 2',                     ('-I', '-j', '2', fa, fb),                      2),
+            ('-I -c',                       ('-I', '-c', fa, fb),                           2),
+            ('-I -q',                       ('-I', '-q', fa, fb),                           2),
+            ('-a count (Zipf)',             ('-a', 'count', fam),                           1),
+            ):
+            run('tsetop ' + name, tsetop(*args), m * n)
+        if setop._importNumpy() is not None:
+            run('tsetop -I --numpy', tsetop('-I', '--numpy', fa, fb), 2 * n)
+
+def benchCompressed(n = 500000):
+    # tsetop on gzip files, decompressing them itself vs. reading them from zcat processes
+    if not shutil.which('zcat') or not shutil.which('bash'):
+        print('compressed input: zcat or bash not found, skipped')
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for name, lines in (('a.gz', tsvLines(n, 1, seed = 1)), ('b.gz', tsvLines(n, 1, seed = 2))):
+            paths.append(os.path.join(directory, name))
+            with gzip.open(paths[-1], 'wt', compresslevel = 6) as f:
+                f.writelines(lines)
+        commands = (
+            ('tsetop -I a.gz b.gz',                     tsetop('-I', *paths)),
+            ('tsetop -I <(zcat a.gz) <(zcat b.gz)',     ['bash', '-c', '"$0" "$1" -I <(zcat "$2") <(zcat "$3")',
+                                                         sys.executable, TSETOP] + paths),
+            ('tsetop -I -o c.gz a.gz b.gz',             tsetop('-I', '-o', os.path.join(directory, 'c.gz'), *paths)),
+            )
+        for name, command in commands:
+            run(name, command, 2 * n)
+
+
+# Baselines
+
+def save(path, size):
+    with open(path, 'w') as f:
+        json.dump({'python': platform.python_version(), 'machine': platform.machine(), 'size': size,
+                   'results': results}, f, indent = 1, sort_keys = True)
+
+def compare(path, size, tolerance):
+    # flags the benchmarks slower or larger than in the baseline by more than the fraction tolerance, returns their
+    # number
+    with open(path) as f:
+        baseline = json.load(f)
+    if baseline.get('size') != size:
+        print('baseline of size %s, not %i: results not comparable'%(baseline.get('size'), size))
+    flagged = 0
+    print()
+    for name, r in results.items():
+        b = baseline['results'].get(name)
+        if b is None:
+            continue
+        for value, label in (('seconds', 'slower'), ('peak_memory', 'larger')):
+            if r[value] is not None and b[value] and r[value] > (1 + tolerance) * b[value]:
+                flagged += 1
+                print('%-56s %5.2fx %s'%(name, r[value] / b[value], label))
+    missing = set(baseline['results']) - set(results)
+    if missing and options.filter is None:
+        print('not run: ' + ', '.join(sorted(missing)))
+    print('%i regressions against %s'%(flagged, path))
+    return flagged
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmarks of setop and tsetop.')
+    parser.add_argument('--size', type = int, default = 100000, help = 'items per input (default: 100000)')
+    parser.add_argument('--repeat', type = int, default = 3, help = 'runs of each benchmark, the best one counts')
+    parser.add_argument('--no-memory', dest = 'memory', action = 'store_false',
+                        help = 'do not measure memory allocated by Python (which takes an extra run)')
+    parser.add_argument('--filter', metavar = '<text>', help = 'run only benchmarks with <text> in their names')
+    parser.add_argument('--save', metavar = '<json>', help = 'save the results as a baseline')
+    parser.add_argument('--compare', metavar = '<json>', help = 'compare the results with a saved baseline')
+    parser.add_argument('--tolerance', type = float, default = 0.25,
+                        help = 'flag benchmarks slower or larger than the baseline by more than this fraction')
+    args    = parser.parse_args()
+    options = args
+    n       = args.size
+    benchOps(n)
+    benchBFiles(n)
+    benchFieldKeys(2 * n)
+    benchMultisetJoin(n, n // 10)
+    benchArrays(5 * n)
+    benchCli(n)
+    benchCompressed(5 * n)
+    if args.save:
+        save(args.save, n)
+    if args.compare and compare(args.compare, n, args.tolerance):
+        sys.exit(1)
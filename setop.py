@@ -1,13 +1,76 @@
 from collections import OrderedDict, deque, Counter
+from itertools import groupby, islice
+from operator import itemgetter
+from array import array
+import contextlib
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import math
+import mmap
+import os
+import pickle
+import stat
+import struct
+import sys
+import tempfile
+import time
+import zlib
+try:
+    import resource
+except ImportError:
+    resource = None
+
+class _OrderedDictMap(OrderedDict):
+    def remove(self, key):
+        del self[key]
 
 def _orderedDictFromUniqueKeysAndValues(kvs):
-    d = OrderedDict()
+    d = _OrderedDictMap()
     for key, value in kvs:
         if key in d:
             raise ValueError('Value %r appears more than once in the set'%key)
         d[key] = value
     return d
 
+def fieldKey(fields, sep = '\t', new_line = '\n'):
+    # key function of lines (str or bytes like sep and new_line) returning the field of the given 0-based index,
+    # or the tuple of the fields for a sequence of indices; lines are split no further than needed (the first field
+    # is just found), ValueError for lines with fewer fields
+    def missing(x, n):
+        return ValueError('Line %r has no field %i (separated by %r)'%(x, n+1, sep))
+    if isinstance(fields, int):
+        n = fields
+        if n == 0:
+            def key(x):
+                i = x.find(sep)
+                if i >= 0:
+                    return x[:i]
+                return x[:-1] if x.endswith(new_line) else x
+        else:
+            def key(x):
+                f = x.split(sep, n+1)
+                if len(f) > n+1:
+                    return f[n]
+                if len(f) < n+1:
+                    raise missing(x, n)
+                y = f[n]
+                return y[:-1] if y.endswith(new_line) else y
+        return key
+    fields  = tuple(fields)
+    m       = max(fields)
+    get     = itemgetter(*fields) if len(fields) > 1 else (lambda f: (f[fields[0]],))
+    def key(x):
+        f = x.split(sep, m+1)
+        if len(f) <= m:
+            raise missing(x, m)
+        if len(f) == m+1 and f[m].endswith(new_line):
+            f[m] = f[m][:-1]
+        return get(f)
+    return key
+
 class _OrderedDictSetMeta(type):
     def __call__(cls, items=None):
         if items == None:
@@ -48,92 +111,681 @@ class _ListDict(dict):
             else:
                 self[k] = [x]
 
+_WIDE_INDEX = 1 << (8 * array('i').itemsize - 1)   # first index of an _OrderedMultiset in 'q' (not 'i') arrays
+
 class _OrderedMultiset():
-    # implements strictly what we need
-    # items must not be integers or tuples
-    
+    # implements strictly what we need: items in their original order, occurrences of the same key linked in a
+    # chain (array of next indices) and the first remaining occurrence of each key (-1 once all are consumed);
+    # pop/remove consume the first remaining occurrence of a key, iteration yields the remaining items in order
+    # items may be anything hashable (or anything at all if key is given)
+
     # Basic special __methods__()
-    
-    def __init__(self, items):
-        od  = OrderedDict()
-        cur   = 1
+
+    def __init__(self, items = (), key = None):
+        values  = []
+        links   = array('i')    # index of the next occurrence of the same key, -1 for the last one
+        ids     = {}            # key -> slot
+        heads   = array('i')    # slot -> index of the first remaining occurrence
+        tails   = array('i')    # slot -> index of the last occurrence (while building)
         for x in items:
-            if x not in od:
-                od[x] = x
+            k = key(x) if key else x
+            i = len(values)
+            if i == _WIDE_INDEX:
+                links, heads, tails = (array('q', a) for a in (links, heads, tails))
+            s = ids.get(k)
+            if s is None:
+                ids[k] = len(heads)
+                heads.append(i)
+                tails.append(i)
             else:
-                xvalue      = od[x]
-                od[cur]     = x
-                if not type(xvalue) == tuple:
-                    assert x == xvalue
-                    od[x]   = (xvalue, deque((cur,)))
-                else:
-                    xvalue[1].append(cur)
-                cur         +=1
-        self.od     = od
-        self.cur    = cur
+                links[tails[s]] = i
+                tails[s]        = i
+            values.append(x)
+            links.append(-1)
+        self.values_    = values
+        self.links      = links
+        self.ids        = ids
+        self.heads      = heads
+        self.key        = key
 
     def __iter__(self):
-        for xvalue in self.od.values():
-            if not type(xvalue) == tuple:
-                yield xvalue
-            else:
-                # xvalue ~ (x, deque[indices])
-                x = xvalue[0]
-                if x is None:   # just indices to multiple items of the same value, not the item itself, first such acts as a sentinel
-                    break
+        ids     = self.ids
+        heads   = self.heads
+        key     = self.key
+        for i, x in enumerate(self.values_):
+            h = heads[ids[key(x) if key else x]]
+            if 0 <= h <= i:         # occurrences before the first remaining one have been consumed
                 yield x
 
     def __contains__(self, key):
-        return key in self.od
+        s = self.ids.get(key)
+        return s is not None and self.heads[s] >= 0
+
+    def copy(self):
+        # shares the items, copies just the consumption state (a single array)
+        c           = _OrderedMultiset.__new__(_OrderedMultiset)
+        c.__dict__  = dict(self.__dict__, heads = array(self.heads.typecode, self.heads))
+        return c
+
+    def keyCounts(self):
+        counts = {}
+        for k, s in self.ids.items():
+            n = 0
+            i = self.heads[s]
+            while i >= 0:
+                n += 1
+                i  = self.links[i]
+            if n:
+                counts[k] = n
+        return counts
 
     # Mapping emulation
 
     def __getitem__(self, key):
-        if key not in self.od:
+        s = self.ids.get(key)
+        if s is None or self.heads[s] < 0:
             raise KeyError(key)
-        return key
+        return self.values_[self.heads[s]]
     def values(self):
         return self.__iter__()
-    
+
     # Pop & Remove
 
     def pop(self, key):
-        value = self.od[key]
-        if not type(value) == tuple:
-            del self.od[key]
-            return value
-        value0 = value[0]
-        if value0 is not None:
-            value1 = value[1]
-            del self.od[key]
-            self.od[key]    = (None, value1)    # create new entry at the end
-            return value0
-        # value ~ (None, deque(indices))
-        indices = value[1]
-        index = indices.popleft()
-        if len(indices) == 0:
-            del self.od[key]
-        return self.od.pop(index)
+        s = self.ids.get(key)
+        if s is None or self.heads[s] < 0:
+            raise KeyError(key)
+        i               = self.heads[s]
+        self.heads[s]   = self.links[i]
+        return self.values_[i]
+
+    def remove(self, key):
+        self.pop(key)
+
+class SetIndex():
+    # b prepared once (with the same uniqueness checks as in SetOp), to be passed as b to any number of
+    # SetIntersection, SetDifference, SetJoin etc. operations, which then probe it without rebuilding it
+    def __init__(self, b, key_b = None, multiset = False):
+        self.key_b      = key_b
+        self.multiset   = multiset
+        if not multiset:
+            self.b      = (
+                _orderedDictFromUniqueKeysAndValues([(key_b(y), y) for y in b])     if key_b    else
+                _OrderedDictSet(b)
+                )
+        else:
+            self.b      = _OrderedMultiset(b, key_b)
+        self.join_table = None
+
+    def probe(self, mutable = False):
+        # structure for one operation, mutable if the operation removes items from it
+        # (multisets always get their own copy of the consumption state)
+        if not self.multiset:
+            return self.b.copy() if mutable else self.b
+        return self.b.copy()
+
+    def joinTable(self):
+        if not self.multiset:
+            return self.b
+        if self.join_table is None:
+            self.join_table = (
+                _ListDict(self.key_b, self.b.values_)   if self.key_b   else
+                _CounterListDict(self.b.keyCounts())
+                )
+        return self.join_table
+
+# Persistent index of the lines of a file: an open addressing table of 64-bit key hashes and line numbers plus the
+# line offsets (in the original order), memory-mapped together with the file itself. Keys are the lines without the
+# line terminator (or whatever key(line) returns), the query keys are stripped of a trailing new line as well.
+
+def _lineKey(line):
+    return line[:-1] if line.endswith(b'\n') else line
+
+def _hash64(k):
+    # not cryptographic, just stable across runs; the table slot comes from the crc32 part
+    return zlib.crc32(k) | zlib.adler32(k) << 32
+
+def _sourceStat(source):
+    st = os.stat(source)
+    return st.st_size, st.st_mtime_ns
+
+def _isFresh(cls, source, path, spec):
+    # whether the file path (cls.defaultPath(source) by default) starts with cls._HEADER of the current version of
+    # source: magic, size, mtime, class specific fields and the length of spec, followed by spec
+    try:
+        with open(path if path else cls.defaultPath(source), 'rb') as f:
+            header = f.read(cls._HEADER.size)
+            if len(header) < cls._HEADER.size:
+                return False
+            fields = cls._HEADER.unpack(header)
+            magic, size, mtime, spec_len = fields[:3] + fields[-1:]
+            return magic == cls.MAGIC and (size, mtime) == _sourceStat(source) and f.read(spec_len) == spec
+    except OSError:
+        return False
+
+def _writeFile(path, write):
+    # write(f) to a temporary file renamed to path once complete, with the permissions of a newly created file
+    directory   = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(dir = directory, delete = False) as f:
+        write(f)
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(f.name, 0o666 & ~umask)
+    os.replace(f.name, path)
+
+class DiskIndex(SetIndex):
+    MAGIC   = b'TSIDX002'
+    # magic, source size, source mtime, lines, slots, first duplicate+1, whether source has \r, spec length
+    _HEADER = struct.Struct('<8sQqQQQQI')
+
+    @staticmethod
+    def defaultPath(source):
+        return source + '.tsidx'
+
+    @staticmethod
+    def _stat(source):
+        return _sourceStat(source)
+
+    @classmethod
+    def isFresh(cls, source, path = None, spec = b''):
+        # whether the index exists and was built for the current version of source with the same key spec
+        return _isFresh(cls, source, path, spec)
+
+    @classmethod
+    def build(cls, source, path = None, key = _lineKey, spec = b''):
+        # writes the index of source (path defaults to <source>.tsidx), key(line) ~ key bytes of a line
+        path        = path if path else cls.defaultPath(source)
+        size, mtime = cls._stat(source)
+        with open(source, 'rb') as f:
+            data    = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) if size else b''
+        offsets     = array('Q', [0])
+        pos         = 0
+        while pos < len(data):
+            end = data.find(b'\n', pos)
+            pos = end + 1 if end >= 0 else len(data)
+            offsets.append(pos)
+        n           = len(offsets) - 1
+        slots       = 8
+        while slots < 2 * n:
+            slots *= 2
+        mask        = slots - 1
+        table       = array('Q', bytes(16 * slots))
+        duplicate   = 0
+        for line_no in range(n):
+            k = key(data[offsets[line_no]:offsets[line_no+1]])
+            h = _hash64(k)
+            i = h & mask
+            while table[2*i+1]:
+                other = table[2*i+1] - 1
+                if not duplicate and table[2*i] == h and key(data[offsets[other]:offsets[other+1]]) == k:
+                    duplicate = line_no + 1
+                i = (i + 1) & mask
+            table[2*i]      = h
+            table[2*i+1]    = line_no + 1
+        # lines end only at \n here, universal newlines also end them at \r
+        cr          = int(data.find(b'\r') >= 0)
+        if size:
+            data.close()
+        header      = cls._HEADER.pack(cls.MAGIC, size, mtime, n, slots, duplicate, cr, len(spec)) + spec
+        def write(f):
+            f.write(header + bytes(-len(header) % 8))
+            offsets.tofile(f)
+            table.tofile(f)
+        _writeFile(path, write)
+
+    def __init__(self, source, path = None, multiset = False, key = _lineKey, spec = b'', encoding = None):
+        # opens a fresh index of source (raises ValueError if it is stale), str keys and values if encoding is given
+        self.key_b      = None
+        self.multiset   = multiset
+        self.key        = key
+        self.encoding   = encoding
+        path            = path if path else DiskIndex.defaultPath(source)
+        if not DiskIndex.isFresh(source, path, spec):
+            raise ValueError('Index %r is missing or out of date'%path)
+        with open(path, 'rb') as f:
+            self.mm     = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        with open(source, 'rb') as f:
+            self.data   = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+        __, __, __, n, slots, duplicate, cr, spec_len = DiskIndex._HEADER.unpack_from(self.mm)
+        start           = DiskIndex._HEADER.size + spec_len
+        start          += -start % 8
+        words           = memoryview(self.mm)[start:].cast('Q')
+        self.n          = n
+        self.carriage_returns = bool(cr)
+        self.mask       = slots - 1
+        self.offsets    = words[:n+1]
+        self.table      = words[n+1:n+1+2*slots]
+        if duplicate and not multiset:
+            raise ValueError('Value %r appears more than once in the set'%self._value(duplicate - 1))
+
+    def _value(self, line_no):
+        line = self.data[self.offsets[line_no]:self.offsets[line_no+1]]
+        return line.decode(self.encoding) if self.encoding else line
+
+    def _find(self, k):
+        # line numbers of key k, in the original order
+        i, line_no = self._lookup(k)
+        while line_no is not None:
+            yield line_no
+            i, line_no = self._lookup(k, (i + 1) & self.mask)
+
+    def _lookup(self, k, i = None, removed = None):
+        # (slot, line number) of the first line of key k not in removed, from slot i of its chain on (None = from its
+        # start), (None, None) if there is none; the lines of a key follow their original order along the chain
+        if self.encoding:
+            k = k.encode(self.encoding)
+        if k.endswith(b'\n'):
+            k = k[:-1]
+        h       = _hash64(k)
+        mask    = self.mask
+        table   = self.table
+        offsets = self.offsets
+        i       = h & mask if i is None else i
+        while True:
+            line_no = table[2*i+1]
+            if not line_no:
+                return None, None
+            line_no -= 1
+            if table[2*i] == h and (removed is None or line_no not in removed) and \
+               self.key(self.data[offsets[line_no]:offsets[line_no+1]]) == k:
+                return i, line_no
+            i = (i + 1) & mask
+
+    def probe(self, mutable = False):
+        return _DiskIndexProbe(self, set() if mutable or self.multiset else None)
+
+    def joinTable(self):
+        return _DiskIndexProbe(self, None, True)
+
+class _DiskIndexProbe():
+    # b as seen by one operation, lines removed by pop()/remove() are recorded in removed; as they are the first lines
+    # of their keys, the lookups of a key resume after the last one removed (its slot + 1 in next)
+    def __init__(self, index, removed, join = False):
+        self.index      = index
+        self.removed    = removed
+        self.join       = join
+        self.next       = {}    # key -> slot after its last removed line
+        # (key, slot, line number) of the last lookup, operations test `in` before getting
+        self.last       = (None, None, None)
+
+    def _first(self, key):
+        # (slot, line number) of the first line of key
+        last_key, i, line_no = self.last
+        if last_key is not None and last_key == key:
+            return i, line_no
+        i, line_no  = self.index._lookup(key, self.next.get(key), self.removed)
+        self.last   = (key, i, line_no)
+        return i, line_no
+
+    def __contains__(self, key):
+        return self._first(key)[1] is not None
+
+    def __getitem__(self, key):
+        if self.join:
+            return [self.index._value(line_no) for line_no in self.index._find(key)]
+        line_no = self._first(key)[1]
+        if line_no is None:
+            raise KeyError(key)
+        return self.index._value(line_no)
+
+    def values(self):
+        for line_no in range(self.index.n):
+            if not self.removed or line_no not in self.removed:
+                yield self.index._value(line_no)
+
+    def pop(self, key):
+        i, line_no = self._first(key)
+        if line_no is None:
+            raise KeyError(key)
+        self.removed.add(line_no)
+        self.next[key]  = (i + 1) & self.index.mask
+        self.last       = (None, None, None)
+        return self.index._value(line_no)
 
     def remove(self, key):
-        value = self.od[key]
-        if not type(value) == tuple:
-            del self.od[key]
+        self.pop(key)
+
+# Approximate set of keys: a blocked Bloom filter, each key sets k bits (a pattern out of 4096) of a single 64-bit word,
+# i.e. a single read-modify-write per key instead of k of them. Sized for about fp_rate false positives (about 1.6
+# bytes per key for 0.01, compared to 1.2 of the classic layout); no false negatives. Standing in for b it answers
+# membership only (intersection, difference); in front of an exact index (e.g. a DiskIndex) it keeps the lookups of
+# most keys not in b off the index.
+# Keys are hashed as bytes without a trailing new line (str encoded with encoding), as in DiskIndex.
+
+def _keyBytes(k, encoding):
+    if isinstance(k, str):
+        k = k.encode(encoding)
+    elif not isinstance(k, bytes):
+        k = repr(k).encode(encoding)
+    return k[:-1] if k.endswith(b'\n') else k
+
+def _bloomFP(bits_per_key, k):
+    # false positive rate: keys per word ~ Poisson, each of them sets a bit of the word with probability k/64
+    lam     = 64 / bits_per_key
+    p       = math.exp(-lam)
+    fp      = 0
+    for j in range(int(lam + 12 * math.sqrt(lam) + 12)):
+        if j:
+            p *= lam / j
+        fp += p * (1 - (1 - k / 64) ** j) ** k
+    return fp
+
+def _bloomSize(fp_rate):
+    # (bits per key, bits set per key) with the least bits per key for fp_rate (at most 256 bits per key)
+    def best(bits_per_key):
+        return min((_bloomFP(bits_per_key, k), k) for k in range(1, 33))
+    low, high = 1.0, 256.0
+    while high - low > 0.05:
+        middle = (low + high) / 2
+        if best(middle)[0] <= fp_rate:
+            high    = middle
+        else:
+            low     = middle
+    return high, best(high)[1]
+
+_bloom_patterns = {}
+
+def _bloomPatterns(k):
+    # 4096 words with k distinct bits set, the same in every run
+    patterns = _bloom_patterns.get(k)
+    if patterns is None:
+        patterns = array('Q')
+        for j in range(4096):
+            bits    = set()
+            d       = b'%i %i'%(k, j)
+            while len(bits) < k:
+                d = hashlib.blake2b(d).digest()
+                for x in d:
+                    if len(bits) < k:
+                        bits.add(x & 63)
+            patterns.append(sum(1 << i for i in bits))
+        _bloom_patterns[k] = patterns
+    return patterns
+
+_DIGEST_BLOCK = 16 << 12
+
+def _spillDigests(digests, f):
+    # writes the 16-byte digests to f in blocks, returns their number
+    n = 0
+    for block in iter(lambda: b''.join(islice(digests, _DIGEST_BLOCK // 16)), b''):
+        f.write(block)
+        n += len(block) // 16
+    f.seek(0)
+    return n
+
+def _readDigests(f):
+    for block in iter(lambda: f.read(_DIGEST_BLOCK), b''):
+        for i in range(0, len(block), 16):
+            yield int.from_bytes(block[i:i + 16], 'little')
+
+class BloomFilter(SetIndex):
+    MAGIC   = b'TSBLM001'
+    _HEADER = struct.Struct('<8sQqQQQI')    # magic, source size, source mtime, words, bits per key, keys, spec length
+
+    @staticmethod
+    def defaultPath(source):
+        return source + '.tsblm'
+
+    @classmethod
+    def isFresh(cls, source, path = None, spec = b''):
+        # whether the filter exists and was saved for the current version of source with the same key spec
+        return _isFresh(cls, source, path, spec)
+
+    def __init__(self, b = (), key_b = None, fp_rate = 0.01, capacity = None, index = None, encoding = 'utf-8'):
+        # filter of the keys of b sized for capacity keys (by default len(b), or the number of items of b, whose hashes
+        # are then spilled to a temporary file first), index ~ the exact SetIndex of b to prefilter
+        if not 0 < fp_rate < 1:
+            raise ValueError('False positive rate %r is not between 0 and 1'%fp_rate)
+        self.encoding   = encoding
+        keys            = map(key_b, b) if key_b else b
+        with contextlib.ExitStack() as stack:
+            hashes      = map(self._hash, keys)
+            if capacity is None:
+                try:
+                    capacity    = len(b)
+                except TypeError:
+                    f           = stack.enter_context(tempfile.TemporaryFile())
+                    capacity    = _spillDigests(map(self._digest, keys), f)
+                    hashes      = _readDigests(f)
+            bits_per_key, k = _bloomSize(fp_rate)
+            self._setWords(array('Q', bytes(8 * max(1, math.ceil(max(capacity, 1) * bits_per_key / 64)))), k)
+            self.n          = 0
+            self._setIndex(index)
+            for h in hashes:
+                self._add(h)
+
+    def _setWords(self, words, k):
+        self.words      = words
+        self.words_n    = len(words)
+        self.hashes_n   = k
+        self.patterns   = _bloomPatterns(k)
+
+    def _setIndex(self, index):
+        self.index      = index
+        self.key_b      = index.key_b       if index is not None    else None
+        self.multiset   = index.multiset    if index is not None    else False
+        self.join_table = None
+
+    def _digest(self, k):
+        return hashlib.blake2b(_keyBytes(k, self.encoding), digest_size = 16).digest()
+
+    def _hash(self, k):
+        # pattern number in the low 12 bits, word number in the rest
+        return int.from_bytes(self._digest(k), 'little')
+
+    def _add(self, h):
+        self.words[(h >> 12) % self.words_n] |= self.patterns[h & 4095]
+        self.n += 1
+
+    def add(self, k):
+        self._add(self._hash(k))
+
+    def __contains__(self, k):
+        h = self._hash(k)
+        p = self.patterns[h & 4095]
+        return self.words[(h >> 12) % self.words_n] & p == p
+
+    def __getitem__(self, k):
+        # there are no items of b, the key stands in for them
+        if k not in self:
+            raise KeyError(k)
+        return k
+
+    def probe(self, mutable = False):
+        if self.index is not None:
+            return _PrefilteredProbe(self, self.index.probe(mutable))
+        if mutable:
+            raise ValueError('Approximate set supports only intersection and difference')
+        return self
+
+    def joinTable(self):
+        if self.index is None:
+            raise ValueError('Approximate set supports only intersection and difference')
+        return self.index.joinTable()
+
+    def save(self, path, source = None, spec = b''):
+        # writes the words (not the index), tied to the current version of source if given
+        size, mtime = _sourceStat(source) if source else (0, 0)
+        header      = self._HEADER.pack(self.MAGIC, size, mtime, self.words_n, self.hashes_n, self.n, len(spec)) + spec
+        def write(f):
+            f.write(header + bytes(-len(header) % 8))
+            self.words.tofile(f)
+        _writeFile(path, write)
+
+    @classmethod
+    def load(cls, path, source = None, spec = b'', index = None, encoding = 'utf-8'):
+        # raises ValueError if the filter was saved for another version of source (or another key spec)
+        if source is not None and not cls.isFresh(source, path, spec):
+            raise ValueError('Bloom filter %r is missing or out of date'%path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < cls._HEADER.size or not data.startswith(cls.MAGIC):
+            raise ValueError('File %r is not a Bloom filter'%path)
+        self            = cls.__new__(cls)
+        __, __, __, words_n, k, self.n, spec_len = cls._HEADER.unpack_from(data)
+        start           = cls._HEADER.size + spec_len
+        start          += -start % 8
+        words           = array('Q')
+        words.frombytes(data[start:start + 8 * words_n])
+        if len(words) != words_n:
+            raise ValueError('Bloom filter %r is truncated'%path)
+        self._setWords(words, k)
+        self.encoding   = encoding
+        self._setIndex(index)
+        return self
+
+class _PrefilteredProbe():
+    # probe of the index behind a Bloom filter, operations test `in` before getting or removing items
+    def __init__(self, bloom, probe):
+        self.bloom = bloom
+        self.probe = probe
+
+    def __contains__(self, key):
+        return key in self.bloom and key in self.probe
+
+    def __getitem__(self, key):
+        return self.probe[key]
+
+    def values(self):
+        return self.probe.values()
+
+    def pop(self, key):
+        return self.probe.pop(key)
+
+    def remove(self, key):
+        self.probe.remove(key)
+
+# Set of keys stored as their 64-bit or 128-bit blake2b digests in an open addressing table (8 or 16 bytes per slot,
+# at most half full) instead of the keys themselves, e.g. to check that the (long) lines of a are unique. Keys are
+# hashed as in BloomFilter. Equal 128-bit digests are taken as equal keys, equal 64-bit digests are confirmed by
+# reread() (returning the keys added so far, in order, e.g. by reading the input again) if given, which is meant for
+# uniqueness checks, where any key found is an error anyway.
+# add() raises ValueError for a key added before (a drop-in for SetOp._UniqueSet); once keys of limit bytes have been
+# added it neither checks nor stores any further keys.
+
+class DigestSet():
+    def __init__(self, digest_size = 16, reread = None, limit = None, encoding = 'utf-8'):
+        if digest_size not in (8, 16):
+            raise ValueError('Digest size %r is neither 8 nor 16 (bytes)'%digest_size)
+        self.digest_size    = digest_size
+        self.reread         = reread
+        self.limit          = limit
+        self.encoding       = encoding
+        self.words          = digest_size // 8
+        self.table          = array('Q', bytes(8 * self.words * 16))
+        self.mask           = 15
+        self.n              = 0
+        self.size           = 0
+
+    def _digest(self, kb):
+        # (1st word, 2nd word or 0), the 1st word is odd (0 ~ empty slot) and gives the slot by its other bits
+        d = hashlib.blake2b(kb, digest_size = self.digest_size).digest()
+        return int.from_bytes(d[:8], 'little') | 1, int.from_bytes(d[8:], 'little')
+
+    def _find(self, kb, h, h2):
+        # slot of kb, or (as ~ complement) the empty slot it would be inserted into
+        table   = self.table
+        mask    = self.mask
+        words   = self.words
+        i       = (h >> 1) & mask
+        while True:
+            t = table[words*i]
+            if not t:
+                return ~i
+            if t == h and (words == 1 and (self.reread is None or self._confirm(kb)) or
+                           words == 2 and table[2*i+1] == h2):
+                return i
+            i = (i + 1) & mask
+
+    def _confirm(self, kb):
+        return any(_keyBytes(k, self.encoding) == kb for k in itertools.islice(self.reread(), self.n))
+
+    def _grow(self):
+        words           = self.words
+        old             = self.table
+        self.table      = array('Q', bytes(16 * len(old)))
+        self.mask       = 2 * self.mask + 1
+        for j in range(0, len(old), words):
+            h = old[j]
+            if h:
+                i = (h >> 1) & self.mask
+                while self.table[words*i]:
+                    i = (i + 1) & self.mask
+                self.table[words*i:words*i+words] = old[j:j+words]
+
+    def __contains__(self, k):
+        kb = _keyBytes(k, self.encoding)
+        return self._find(kb, *self._digest(kb)) >= 0
+
+    def add(self, k):
+        if self.limit is not None and self.size >= self.limit:
             return
-        if value[0] is not None:
-            value1 = value[1]
-            del self.od[key]
-            self.od[key]    = (None, value1)    # create new entry at the end
+        kb      = _keyBytes(k, self.encoding)
+        h, h2   = self._digest(kb)
+        i       = self._find(kb, h, h2)
+        if i >= 0:
+            raise ValueError('Value %r appears more than once in the set'%k)
+        i       = ~i
+        self.table[self.words*i] = h
+        if self.words == 2:
+            self.table[2*i+1] = h2
+        self.n     += 1
+        self.size  += len(kb)
+        if 2 * self.n > self.mask:
+            self._grow()
+
+    def __len__(self):
+        return self.n
+
+class DigestSetIndex(SetIndex):
+    # unique set of the keys of b as a DigestSet, for intersection and difference (the keys stand in for the items of
+    # b, which makes no difference for whole lines as the keys)
+    def __init__(self, b, key_b = None, digest_size = 16, encoding = 'utf-8'):
+        self.key_b      = key_b
+        self.multiset   = False
+        self.b          = DigestSet(digest_size, encoding = encoding)
+        for y in b:
+            self.b.add(key_b(y) if key_b else y)
+
+    def __contains__(self, k):
+        return k in self.b
+
+    def __getitem__(self, k):
+        if k not in self.b:
+            raise KeyError(k)
+        return k
+
+    def probe(self, mutable = False):
+        if mutable:
+            raise ValueError('Digest set supports only intersection and difference')
+        return self
+
+    def joinTable(self):
+        raise ValueError('Digest set supports only intersection and difference')
+
+def _identity(x):
+    return x
+
+def _xOrY(x, y):
+    return x if x is not None else y
+
+def _noValue(*__):
+    return None
+
+_NO_RESULT = object()
+
+def batches(items, n = 1024):
+    # lists of the next (at most) n items
+    it = iter(items)
+    while True:
+        batch = list(islice(it, n))
+        if not batch:
             return
-        # value ~ (None, deque(indices))
-        indices = value[1]
-        index = indices.popleft()
-        if len(indices) == 0:
-            del self.od[key]
-        del self.od[index]
-    
+        yield batch
 
 class SetOp():
+    _mutates_b = False   # whether the (unique set) b is modified while iterating
+
     class _NullSetType():
         def add(self, __):
             pass
@@ -142,37 +794,195 @@ class SetOp():
             if x in self:
                 raise ValueError('Value %r appears more than once in the set'%x)
             super().add(x)
+        def addBatch(self, xs):
+            s = set(xs)
+            if len(s) < len(xs) or not self.isdisjoint(s):
+                for x in xs:
+                    self.add(x)     # raises for the first duplicate
+            self |= s
     _NullSet = _NullSetType()
     
     
-    def __init__(self, a, b, multiset=False, key_a = None, key_b = None, value_ab = None, b_as_is = False):
+    # unique_check ~ set of the keys of a, whose add() raises ValueError for duplicates (e.g. a DigestSet)
+    def __init__(self, a, b, multiset=False, key_a = None, key_b = None, value_ab = None, b_as_is = False,
+                 unique_check = None):
         self.multiset   = multiset
         if not multiset:
-            self.a_set  = SetOp._UniqueSet()
+            self.a_set  = unique_check if unique_check is not None else SetOp._UniqueSet()
         else:
-            if (key_a or key_b) and not isinstance(self, SetJoin):
-                raise ValueError('Key functions provided for non-join operation on multisets')
             self.a_set  = SetOp._NullSet
 
         self.a          = a.__iter__()
+        if isinstance(b, SetIndex):
+            if b.multiset != multiset:
+                raise ValueError('Index built for %s used for %s'%(
+                    ('a multiset', 'a set') if b.multiset else ('a set', 'a multiset')
+                    ))
+            if key_b:
+                raise ValueError('Key function for b provided along with an index')
+            key_b   = b.key_b
+            b       = b.probe(self._mutates_b)
+            b_as_is = True
         self.b          = (
             b                           if b_as_is  else
-            _OrderedMultiset(b)         if multiset else
+            _OrderedMultiset(b, key_b)  if multiset else
             _orderedDictFromUniqueKeysAndValues([(key_b(y), y) for y in b])     if key_b    else
             _OrderedDictSet(b)   # checks uniqueness
             )
                             
-        self.key_a      = key_a         if key_a            else (lambda x: x)
+        self.key_a      = key_a         if key_a            else _identity
         self.value_ab   = (value_ab      if value_ab        else
             (lambda x, y: (x, y))       if key_a or key_b   else
-            (lambda x, y: x if x is not None else y)                        # TODO: regardless of key functions?
+            _xOrY                                                           # TODO: regardless of key functions?
             )
 
+    def iterBatches(self, n = 1024):
+        # the results in lists of at most n
+        return batches(self, n)
+
+    def count(self):
+        # number of the results, without computing their values (value_ab is not called)
+        self.value_ab = _noValue
+        return sum(map(len, self.iterBatches()))
+
+    def any(self):
+        # whether there are any results, reading a only as far as the first one (the rest of a is then neither read
+        # nor checked for uniqueness)
+        self.value_ab   = _noValue
+        results         = iter(self)
+        found           = next(results, _NO_RESULT) is not _NO_RESULT
+        results.close()
+        self.a          = None
+        return found
+
+    def tableSizes(self):
+        # numbers of keys currently held in memory for b and for the uniqueness check of a, where known (with a as the
+        # build side, those of the index of a and of the uniqueness check of b)
+        if getattr(self, 'build', 'b') == 'a':
+            return {side: len(table) for side, table in self.built.items()}
+        sizes   = {}
+        b       = getattr(self, 'b', None)
+        if isinstance(b, DigestSetIndex):
+            b = b.b
+        if isinstance(b, _OrderedMultiset):
+            sizes['b'] = len(b.ids)
+        elif isinstance(b, (dict, set, DigestSet)):
+            sizes['b'] = len(b)
+        if isinstance(getattr(self, 'a_set', None), (set, DigestSet)):
+            sizes['a'] = len(self.a_set)
+        return sizes
+
+    def _addKeys(self, ks):
+        if isinstance(self.a_set, SetOp._UniqueSet):
+            self.a_set.addBatch(ks)
+        else:
+            for k in ks:
+                self.a_set.add(k)
+
+    def _keyBatches(self, n):
+        # (items, keys) of a in batches of n, the keys added to a_set
+        for xs in batches(self.a, n):
+            ks = xs if self.key_a is _identity else list(map(self.key_a, xs))
+            self._addKeys(ks)
+            yield xs, ks
+
+# Build side: the input hashed in memory, b by default while a is streamed. With build = 'a' a (with the position of
+# each item) is hashed instead and b streamed, the results are still in the order of a; the uniqueness of b (as a set)
+# is then checked by a DigestSet of the 128-bit digests of its keys (16 to 32 bytes per key instead of the keys, but
+# a digest per item of b, several times slower than hashing b). build = 'auto' therefore picks a only if b needs no
+# such check (multisets) and a is a smaller regular file than b.
+
+def _sizeHint(items):
+    # size of a regular file (object), None if unknown
+    try:
+        st = os.fstat(items.fileno())
+    except (AttributeError, OSError, ValueError):
+        return None
+    return st.st_size if stat.S_ISREG(st.st_mode) else None
+
+def _buildSide(build, a, b, multiset):
+    if build not in ('auto', 'a', 'b'):
+        raise ValueError('Build side %r is none of auto, a and b'%build)
+    if isinstance(b, SetIndex):
+        if build == 'a':
+            raise ValueError('Index of b used with a as the build side')
+        return 'b'
+    if build == 'auto':
+        if not multiset:
+            return 'b'
+        size_a, size_b = _sizeHint(a), _sizeHint(b)
+        return 'a' if size_a is not None and size_b is not None and size_a < size_b else 'b'
+    return build
+
+_UNMATCHED = object()
+
+def _matchBuiltA(a, b, multiset, key_a, key_b, join, built, unique_check = None):
+    # (items of a, their matches in b), a match ~ the item of b (a list of them for a join of multisets) or _UNMATCHED;
+    # the tables are put in built ('a' and 'b' for the uniqueness check of a set b); the keys of a set a are checked by
+    # unique_check if given (duplicates it lets pass, e.g. beyond its limit, are matched as well)
+    xs      = []
+    # key -> position (set), deque of positions not matched yet (intersection) or positions (join)
+    index   = built['a'] = {}
+    repeats = {}    # key -> further positions of a set a
+    for x in a:
+        k = key_a(x)
+        if not multiset:
+            if unique_check is not None:
+                unique_check.add(k)
+            if k in index:
+                if unique_check is None:
+                    raise ValueError('Value %r appears more than once in the set'%k)
+                repeats.setdefault(k, []).append(len(xs))
+            else:
+                index[k] = len(xs)
+        else:
+            positions = index.get(k)
+            if positions is None:
+                positions = index[k] = [] if join else deque()
+            positions.append(len(xs))
+        xs.append(x)
+    ys      = [[] for __ in xs] if multiset and join else len(xs) * [_UNMATCHED]
+    b_set   = DigestSet(16) if not multiset else SetOp._NullSet
+    if not multiset:
+        built['b'] = b_set
+    for y in b:
+        k = key_b(y)
+        b_set.add(k)
+        m = index.get(k)
+        if m is None:
+            continue
+        if not multiset:
+            ys[m] = y
+            for i in repeats.get(k, ()):
+                ys[i] = y
+        elif join:
+            for i in m:
+                ys[i].append(y)
+        elif m:
+            ys[m.popleft()] = y
+    return xs, ys
+
 class SetIntersection(SetOp):
+    def __init__(self, a, b, multiset=False, key_a = None, key_b = None, value_ab = None, b_as_is = False,
+                 unique_check = None, build = 'b'):
+        self.build = 'b' if b_as_is else _buildSide(build, a, b, multiset)
+        if self.build == 'b':
+            super().__init__(a, b, multiset, key_a, key_b, value_ab, b_as_is, unique_check)
+        else:
+            super().__init__(a, b.__iter__(), multiset, key_a, key_b, value_ab, True)
+            self.key_b          = key_b if key_b else (lambda y: y)
+            self.built          = {}
+            self.unique_check   = unique_check
+
     def __iter__(self):
         if self.a is None:
             raise LookupError('Cannot iterate more than once')
-        if not self.multiset:
+        if self.build == 'a':
+            for x, y in zip(*_matchBuiltA(self.a, self.b, self.multiset, self.key_a, self.key_b, False, self.built,
+                                          self.unique_check)):
+                if y is not _UNMATCHED:
+                    yield self.value_ab(x, y)
+        elif not self.multiset:
             for x in self.a:
                 k = self.key_a(x)
                 self.a_set.add(k)   # serves as safety check that a is actually a set (of unique values)
@@ -186,7 +996,49 @@ class SetIntersection(SetOp):
                     yield self.value_ab(x, y)            
         self.a = None
 
+    def iterBatches(self, n = 1024):
+        # a probed by batches: the uniqueness of its keys checked by set operations and the items of a (the results
+        # for the default value_ab) selected by a comprehension, instead of a generator step per item
+        if self.multiset or self.build == 'a':
+            return super().iterBatches(n)
+        return self._iterBatches(n)
+
+    def count(self):
+        # keys of a just looked up (or popped from a multiset b)
+        if self.build == 'a':
+            return super().count()
+        if self.a is None:
+            raise LookupError('Cannot iterate more than once')
+        b = self.b
+        n = 0
+        if not self.multiset:
+            for __, ks in self._keyBatches(1024):
+                n += sum(map(b.__contains__, ks))
+        else:
+            for x in self.a:
+                k = self.key_a(x)
+                if k in b:
+                    b.remove(k)
+                    n += 1
+        self.a = None
+        return n
+
+    def _iterBatches(self, n):
+        if self.a is None:
+            raise LookupError('Cannot iterate more than once')
+        b = self.b
+        for xs, ks in self._keyBatches(n):
+            if self.value_ab is _xOrY:
+                batch = [x for x, k in zip(xs, ks) if k in b]
+            else:
+                batch = [self.value_ab(x, b[k]) for x, k in zip(xs, ks) if k in b]
+            if batch:
+                yield batch
+        self.a = None
+
 class SetUnion(SetOp):
+    _mutates_b = True
+
     def __iter__(self):
         if self.a is None:
             raise LookupError('Cannot iterate more than once')
@@ -199,6 +1051,21 @@ class SetUnion(SetOp):
             yield self.value_ab(None, y)
         self.a = None
 
+    def count(self):
+        # items of a and the rest of b
+        if self.a is None:
+            raise LookupError('Cannot iterate more than once')
+        b = self.b
+        n = 0
+        for x in self.a:
+            k = self.key_a(x)
+            self.a_set.add(k)
+            if k in b:
+                b.remove(k)
+            n += 1
+        self.a = None
+        return n + sum(1 for __ in b.values())
+
 class SetDifference(SetOp):
     def __iter__(self):
         if self.a is None:
@@ -218,8 +1085,47 @@ class SetDifference(SetOp):
                     yield self.value_ab(x, None)
         self.a = None
 
+    def iterBatches(self, n = 1024):
+        # as SetIntersection.iterBatches()
+        if self.multiset:
+            return super().iterBatches(n)
+        return self._iterBatches(n)
+
+    def count(self):
+        if self.a is None:
+            raise LookupError('Cannot iterate more than once')
+        b = self.b
+        n = 0
+        if not self.multiset:
+            for __, ks in self._keyBatches(1024):
+                n += len(ks) - sum(map(b.__contains__, ks))
+        else:
+            for x in self.a:
+                k = self.key_a(x)
+                if k in b:
+                    b.remove(k)
+                else:
+                    n += 1
+        self.a = None
+        return n
+
+    def _iterBatches(self, n):
+        if self.a is None:
+            raise LookupError('Cannot iterate more than once')
+        b = self.b
+        for xs, ks in self._keyBatches(n):
+            if self.value_ab is _xOrY:
+                batch = [x for x, k in zip(xs, ks) if k not in b]
+            else:
+                batch = [self.value_ab(x, None) for x, k in zip(xs, ks) if k not in b]
+            if batch:
+                yield batch
+        self.a = None
+
 
 class SetSymmetricDifference(SetOp):
+    _mutates_b = True
+
     def __iter__(self):
         if self.a is None:
             raise LookupError('Cannot iterate more than once')
@@ -234,17 +1140,45 @@ class SetSymmetricDifference(SetOp):
             yield self.value_ab(None, y)
         self.a = None
 
+    def count(self):
+        # items of a not in b and the rest of b
+        if self.a is None:
+            raise LookupError('Cannot iterate more than once')
+        b = self.b
+        n = 0
+        for x in self.a:
+            k = self.key_a(x)
+            self.a_set.add(k)
+            if k in b:
+                b.remove(k)
+            else:
+                n += 1
+        self.a = None
+        return n + sum(1 for __ in b.values())
+
 # Two metaclassess to create a class cluster:
 class SetJoinMeta(type):
-    def __call__(cls, a, b, multiset=False, key_a = None, key_b = None, value_ab = (lambda x,y: (x,y)), left = False):
+    # multiplicity ~ value_ab(x, y, n) once for the n equal items y of b joined with x instead of n times value_ab(x, y)
+    def __call__(cls, a, b, multiset=False, key_a = None, key_b = None, value_ab = None, left = False,
+                 unique_check = None, build = 'b', multiplicity = False):
         assert cls == SetJoin, cls
-        if not multiset:
-            i = _USetJoin(a, b,                     False,   key_a, key_b, value_ab)
+        if value_ab is None:
+            value_ab = (lambda x,y,n: (x,y,n)) if multiplicity else (lambda x,y: (x,y))
+        if _buildSide(build, a, b, multiset) == 'a':
+            i = _ASetJoin(a, b,                     multiset, key_a, key_b, value_ab, unique_check)
+        elif isinstance(b, SetIndex) and multiset:
+            if key_b:
+                raise ValueError('Key function for b provided along with an index')
+            i = _MSetJoin(a, b.joinTable(),         True,    key_a, None,  value_ab)
+        elif not multiset:
+            i = _USetJoin(a, b,                     False,   key_a, key_b,
+                          (lambda x,y: value_ab(x,y,1)) if multiplicity else value_ab, unique_check)
         elif not key_b:
             i = _MSetJoin(a, _CounterListDict(b),   True,    key_a, None,  value_ab)
         else:
             i = _MSetJoin(a, _ListDict(key_b, b),   True,    key_a, None,  value_ab)
-        i.left = left
+        i.left          = left
+        i.multiplicity  = multiplicity
         return i
 
 class ConcreteSetJoinMeta(SetJoinMeta):
@@ -255,8 +1189,8 @@ class SetJoin(SetOp, metaclass = SetJoinMeta):
     pass
 
 class _USetJoin(SetJoin, metaclass = ConcreteSetJoinMeta):
-    def __init__(self, a, b, multiset, key_a, key_b, value_ab):
-        super().__init__(a, b, multiset, key_a, key_b, value_ab)
+    def __init__(self, a, b, multiset, key_a, key_b, value_ab, unique_check = None):
+        super().__init__(a, b, multiset, key_a, key_b, value_ab, unique_check = unique_check)
 
     def __iter__(self):
         if self.a is None:
@@ -270,6 +1204,16 @@ class _USetJoin(SetJoin, metaclass = ConcreteSetJoinMeta):
                 yield self.value_ab(x, None)
         self.a = None
 
+    def count(self):
+        if self.a is None:
+            raise LookupError('Cannot iterate more than once')
+        b = self.b
+        n = 0
+        for __, ks in self._keyBatches(1024):
+            n += len(ks) if self.left else sum(map(b.__contains__, ks))
+        self.a = None
+        return n
+
 class _MSetJoin(SetJoin, metaclass = ConcreteSetJoinMeta):
     def __init__(self, a, b, multiset, key_a, key_b, value_ab):
         super().__init__(a, b, multiset, key_a, key_b, value_ab, b_as_is = True)
@@ -277,11 +1221,1431 @@ class _MSetJoin(SetJoin, metaclass = ConcreteSetJoinMeta):
     def __iter__(self):
         if self.a is None:
             raise LookupError('Cannot iterate more than once')
+        b           = self.b
+        key_a       = self.key_a
+        value_ab    = self.value_ab
+        if isinstance(b, _CounterListDict):
+            # the items of b are the keys themselves: their counts instead of count*[key] lists (value_ab called
+            # for each row, its values may be mutable, once for a row of multiplicity)
+            for x in self.a:
+                k = key_a(x)
+                n = Counter.get(b, k)
+                if n:
+                    if self.multiplicity:
+                        yield value_ab(x, k, n)
+                    else:
+                        for __ in range(n):
+                            yield value_ab(x, k)
+                elif self.left:
+                    yield value_ab(x, None, 1) if self.multiplicity else value_ab(x, None)
+        else:
+            counts = {}     # key -> [(item of b, count), ...] for multiplicity
+            for x in self.a:
+                k = key_a(x)
+                if k in b:
+                    if self.multiplicity:
+                        c = counts.get(k)
+                        if c is None:
+                            c = counts[k] = list(Counter(b[k]).items())
+                        for y, n in c:
+                            yield value_ab(x, y, n)
+                    else:
+                        for y in b[k]:
+                            yield value_ab(x, y)
+                elif self.left:
+                    yield value_ab(x, None, 1) if self.multiplicity else value_ab(x, None)
+        self.a = None
+
+    def count(self):
+        # the counts of the keys of a in b summed (rows of multiplicity counted as the others)
+        if not isinstance(self.b, _CounterListDict) or self.multiplicity:
+            return super().count()
+        if self.a is None:
+            raise LookupError('Cannot iterate more than once')
+        b = self.b
+        n = 0
         for x in self.a:
-            k = self.key_a(x)
-            if k in self.b:
-                for y in self.b[k]:
-                   yield self.value_ab(x, y)
+            m = Counter.get(b, self.key_a(x), 0)
+            n += m if m or not self.left else 1
+        self.a = None
+        return n
+
+class _ASetJoin(SetJoin, metaclass = ConcreteSetJoinMeta):
+    # a as the build side, sets and multisets
+    def __init__(self, a, b, multiset, key_a, key_b, value_ab, unique_check = None):
+        super().__init__(a, b.__iter__(), multiset, key_a, None, value_ab, b_as_is = True)
+        self.key_b          = key_b if key_b else (lambda y: y)
+        self.build          = 'a'
+        self.built          = {}
+        self.unique_check   = unique_check
+
+    def __iter__(self):
+        if self.a is None:
+            raise LookupError('Cannot iterate more than once')
+        value_ab = (lambda x,y,n: self.value_ab(x,y)) if not self.multiplicity else self.value_ab
+        for x, y in zip(*_matchBuiltA(self.a, self.b, self.multiset, self.key_a, self.key_b, True, self.built,
+                                      self.unique_check)):
+            if not self.multiset:
+                if y is not _UNMATCHED:
+                    yield value_ab(x, y, 1)
+                elif self.left:
+                    yield value_ab(x, None, 1)
+            else:
+                if self.multiplicity:
+                    for z, n in Counter(y).items():
+                        yield value_ab(x, z, n)
+                else:
+                    for z in y:
+                        yield value_ab(x, z, 1)
+                if not y and self.left:
+                    yield value_ab(x, None, 1)
+        self.a = None
+
+# Incremental operation: a growing a (e.g. a log followed as it is appended to, or read from a client) fed by
+# batches, each probing b, a SetIndex that may be replaced (e.g. reloaded) between them. The keys of a are checked for
+# uniqueness across all the batches and replacements by a single set, so the work per item does not grow with the
+# batches; items of a multiset b stay consumed by the earlier batches until b is replaced, as do the items of b
+# matched for union and symmetric difference, whose rest follows the end of a (finish()).
+
+class IncrementalSetOp():
+    def __init__(self, op, b, multiset=False, key_a = None, value_ab = None, unique_check = None, **kwargs):
+        if op not in (SetIntersection, SetUnion, SetDifference, SetSymmetricDifference, SetJoin):
+            raise ValueError('Operation %s is none of SetIntersection, SetUnion, SetDifference, '
+                             'SetSymmetricDifference and SetJoin'%op.__name__)
+        self.op         = op
+        self.multiset   = multiset
+        self.key_a      = key_a
+        self.value_ab   = value_ab
+        self.kwargs     = kwargs
+        self.a_set      = None if multiset else unique_check if unique_check is not None else SetOp._UniqueSet()
+        self.replace(b)
+
+    def replace(self, b):
+        if b.multiset != self.multiset:
+            raise ValueError('Index built for %s used for %s'%(
+                ('a multiset', 'a set') if b.multiset else ('a set', 'a multiset')
+                ))
+        self.b      = b
+        # consumption state of b shared by the batches (joins do not consume b)
+        self.probe  = b.probe(True) if self.op._mutates_b or self.multiset and self.op is not SetJoin else None
+
+    def _valueAB(self):
+        return self.value_ab if self.value_ab else (lambda x, y: (x, y)) if self.key_a else _xOrY
+
+    def feed(self, items):
+        # list of the results for the next items of a
+        if self.op._mutates_b:
+            # the items of a as by SetUnion and SetSymmetricDifference, without the rest of b
+            b           = self.probe
+            key_a       = self.key_a if self.key_a else _identity
+            value_ab    = self._valueAB()
+            a_set       = self.a_set if self.a_set is not None else SetOp._NullSet
+            results     = []
+            for x in items:
+                k = key_a(x)
+                a_set.add(k)
+                if self.op is SetUnion:
+                    results.append(value_ab(x, b.pop(k) if k in b else None))
+                elif k in b:
+                    b.remove(k)
+                else:
+                    results.append(value_ab(x, None))
+            return results
+        if self.probe is not None:
+            c = self.op(items, self.probe, True, self.key_a, None, self.value_ab, b_as_is = True, **self.kwargs)
+        else:
+            c = self.op(items, self.b, self.multiset, self.key_a, None, self.value_ab, unique_check = self.a_set,
+                        **self.kwargs)
+        return [x for batch in c.iterBatches() for x in batch]
+
+    def finish(self):
+        # list of the results after the end of a, the rest of b for union and symmetric difference
+        if not self.op._mutates_b:
+            return []
+        value_ab = self._valueAB()
+        return [value_ab(None, y) for y in self.probe.values()]
+
+# N-ary operations: a single pass over every input with one lookup per item, instead of chaining binary operations
+# (which would pass every item of a through n-1 generators); the results are the same as those of the chained
+# SetIntersection/SetUnion with the default value_ab, i.e. the (first occurring) items themselves.
+
+class NarySetOp(SetOp):
+    # a ~ the first input, bs ~ the other inputs, keys_b ~ key function for each of bs (or None)
+    def __init__(self, a, bs, multiset=False, key_a = None, keys_b = None, unique_check = None):
+        self.multiset   = multiset
+        self.a_set      = (
+            SetOp._NullSet          if multiset                 else
+            unique_check            if unique_check is not None else
+            SetOp._UniqueSet()
+            )
+        self.a          = a.__iter__()
+        self.bs         = list(bs)
+        self.key_a      = key_a if key_a else (lambda x: x)
+        self.keys_b     = [k if k else (lambda y: y) for k in (keys_b if keys_b else len(self.bs) * [None])]
+        if len(self.keys_b) != len(self.bs):
+            raise ValueError('Number of key functions does not match the number of inputs')
+
+class NarySetIntersection(NarySetOp):
+    def __init__(self, a, bs, multiset=False, key_a = None, keys_b = None, unique_check = None):
+        super().__init__(a, bs, multiset, key_a, keys_b, unique_check)
+        if not multiset:
+            # key -> bit mask of the inputs containing it
+            table = {}
+            for i, (b, key) in enumerate(zip(self.bs, self.keys_b)):
+                bit = 1 << i
+                for y in b:
+                    k       = key(y)
+                    mask    = table.get(k, 0)
+                    if mask & bit:
+                        raise ValueError('Value %r appears more than once in the set'%k)
+                    table[k] = mask | bit
+            full        = (1 << len(self.bs)) - 1
+            self.b      = {k for k, mask in table.items() if mask == full}
+        else:
+            # key -> minimum count
+            table = None
+            for b, key in zip(self.bs, self.keys_b):
+                counts = Counter(map(key, b))
+                table  = counts if table is None else {k: min(n, counts[k]) for k, n in table.items() if k in counts}
+            self.b      = table if table is not None else {}
+        self.bs = None
+
+    def __iter__(self):
+        if self.a is None:
+            raise LookupError('Cannot iterate more than once')
+        if not self.multiset:
+            for x in self.a:
+                k = self.key_a(x)
+                self.a_set.add(k)   # serves as safety check that a is actually a set (of unique values)
+                if k in self.b:
+                    yield x
+        else:
+            for x in self.a:
+                k = self.key_a(x)
+                n = self.b.get(k)
+                if n:
+                    self.b[k] = n - 1
+                    yield x
+        self.a = None
+
+class NarySetUnion(NarySetOp):
+    table = None    # the keys of all the inputs once iterated
+
+    def tableSizes(self):
+        # the uniqueness of the inputs is checked by the table (a_set is not used)
+        return {'inputs': len(self.table)} if self.table is not None else {}
+
+    def __iter__(self):
+        if self.a is None:
+            raise LookupError('Cannot iterate more than once')
+        a, self.a = self.a, None
+        inputs = [(a, self.key_a)] + list(zip(self.bs, self.keys_b))
+        self.bs = None
+        if not self.multiset:
+            seen = self.table = {}  # key -> index of the last input containing it
+            for i, (items, key) in enumerate(inputs):
+                for x in items:
+                    k = key(x)
+                    j = seen.get(k)
+                    if j is None:
+                        yield x
+                    elif j == i:
+                        raise ValueError('Value %r appears more than once in the set'%k)
+                    seen[k] = i
+        else:
+            emitted = self.table = Counter()    # key -> maximum count so far
+            for items, key in inputs:
+                occurrences = Counter()
+                for x in items:
+                    k = key(x)
+                    n = occurrences[k] + 1
+                    occurrences[k] = n
+                    if n > emitted[k]:
+                        emitted[k] = n
+                        yield x
+
+# Merge-based operations on sorted inputs: both inputs are streamed in lockstep, nothing is materialized.
+
+def _sortedKeys(items, key, unique):
+    # yields (key, item), fails as soon as the input turns out not to be sorted (or to contain duplicates if unique)
+    items   = items.__iter__()
+    for x in items:
+        prev = key(x)
+        yield prev, x
+        break
+    for x in items:
+        k = key(x)
+        if k < prev or (unique and not prev < k):
+            if not k < prev:
+                raise ValueError('Value %r appears more than once in the set'%k)
+            raise ValueError('Input is not sorted: %r follows %r'%(k, prev))
+        prev = k
+        yield k, x
+
+def _mergeSorted(a, b, key_a, key_b, unique):
+    # pairs the n-th occurrence of a key in a with the n-th occurrence in b, yields (x, y), None for a missing side
+    a   = _sortedKeys(a, key_a, unique)
+    b   = _sortedKeys(b, key_b, unique)
+    end = (None, None)
+    ka, x = next(a, end)
+    kb, y = next(b, end)
+    while x is not None and y is not None:
+        if ka < kb:
+            yield x, None
+            ka, x = next(a, end)
+        elif kb < ka:
+            yield None, y
+            kb, y = next(b, end)
+        else:
+            yield x, y
+            ka, x = next(a, end)
+            kb, y = next(b, end)
+    while x is not None:
+        yield x, None
+        ka, x = next(a, end)
+    while y is not None:
+        yield None, y
+        kb, y = next(b, end)
+
+class SortedSetOp(SetOp):
+    # same interface as SetOp, but a and b must be sorted by their keys (non-decreasing for multisets, increasing for sets)
+    # results are produced in the merged (sorted) order
+    def __init__(self, a, b, multiset=False, key_a = None, key_b = None, value_ab = None):
+        self.multiset   = multiset
+        self.a          = a
+        self.b          = b
+        self.key_a      = key_a         if key_a            else (lambda x: x)
+        self.key_b      = key_b         if key_b            else (lambda x: x)
+        self.value_ab   = (value_ab      if value_ab        else
+            (lambda x, y: (x, y))       if key_a or key_b   else
+            (lambda x, y: x if x is not None else y)
+            )
+
+    def _merged(self):
+        if self.a is None:
+            raise LookupError('Cannot iterate more than once')
+        a, self.a = self.a, None
+        return _mergeSorted(a, self.b, self.key_a, self.key_b, not self.multiset)
+
+class SortedSetIntersection(SortedSetOp):
+    def __iter__(self):
+        for x, y in self._merged():
+            if x is not None and y is not None:
+                yield self.value_ab(x, y)
+
+class SortedSetUnion(SortedSetOp):
+    def __iter__(self):
+        for x, y in self._merged():
+            yield self.value_ab(x, y)
+
+class SortedSetDifference(SortedSetOp):
+    def __iter__(self):
+        for x, y in self._merged():
+            if y is None:
+                yield self.value_ab(x, None)
+
+class SortedSetSymmetricDifference(SortedSetOp):
+    def __iter__(self):
+        for x, y in self._merged():
+            if y is None:
+                yield self.value_ab(x, None)
+            elif x is None:
+                yield self.value_ab(None, y)
+
+class SortedSetJoin(SortedSetOp):
+    # for multisets each x is joined with all ys of the same key, so a single group of equal keys in b is buffered
+    def __init__(self, a, b, multiset=False, key_a = None, key_b = None, value_ab = (lambda x,y: (x,y)), left = False):
+        super().__init__(a, b, multiset, key_a, key_b, value_ab)
+        self.left       = left
+
+    def __iter__(self):
+        if self.a is None:
+            raise LookupError('Cannot iterate more than once')
+        a, self.a = self.a, None
+        unique  = not self.multiset
+        b       = _sortedKeys(self.b, self.key_b, unique)
+        end     = (None, None)
+        kb, y   = next(b, end)
+        group   = []        # ys of the key kg
+        kg      = None
+        for ka, x in _sortedKeys(a, self.key_a, unique):
+            if not group or kg != ka:
+                while y is not None and kb < ka:
+                    kb, y = next(b, end)
+                group = []
+                kg    = ka
+                while y is not None and kb == ka:
+                    group.append(y)
+                    kb, y = next(b, end)
+            if group:
+                for y_ in group:
+                    yield self.value_ab(x, y_)
             elif self.left:
                 yield self.value_ab(x, None)
-        self.a = None
+
+# Out-of-core (grace hash) execution: when b does not fit into memory_limit bytes, both inputs are hash partitioned
+# into temporary files by key, each partition is processed on its own and the results are merged back into the
+# original order (a-order first, then b-order for the rest of b).
+
+class _Tagged():
+    # item tagged with its position in the input, hashes and compares as the item itself
+    __slots__ = ('tag', 'item')
+    def __init__(self, tag, item):
+        self.tag    = tag
+        self.item   = item
+    def __eq__(self, other):
+        return type(other) == _Tagged and self.item == other.item
+    def __hash__(self):
+        return hash(self.item)
+    def __repr__(self):
+        return repr(self.item)
+
+_SPILL_BATCH = 1024
+
+def _writeBatches(f, items):
+    batch = []
+    for x in items:
+        batch.append(x)
+        if len(batch) >= _SPILL_BATCH:
+            pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+            batch = []
+    if batch:
+        pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+
+def _readBatches(f):
+    f.seek(0)
+    while True:
+        try:
+            batch = pickle.load(f)
+        except EOFError:
+            return
+        yield from batch
+
+def _partition(tagged_items, key, files):
+    # tagged_items ~ (tag, item), distributed among files by the hash of key(item)
+    n = len(files)
+    _route(((hash(key(x)) % n, t, x) for t, x in tagged_items), files)
+
+def _spillSized(tagged_items, key, files, depth):
+    # _partition by a hash of its own for each depth of repartitioning, ([bytes], [items]) of each file
+    n       = len(files)
+    sizes   = [0] * n
+    counts  = [0] * n
+    overhead = SpillingSetOp._ENTRY_OVERHEAD
+    def routed():
+        for t, x in tagged_items:
+            i = hash((depth, key(x))) % n if depth else hash(key(x)) % n
+            sizes[i]    += sys.getsizeof(x) + overhead
+            counts[i]   += 1
+            yield i, t, x
+    _route(routed(), files)
+    return sizes, counts
+
+def _route(routed_items, files):
+    # routed_items ~ (file index, tag, item)
+    batches = [[] for __ in files]
+    for i, t, x in routed_items:
+        batch   = batches[i]
+        batch.append((t, x))
+        if len(batch) >= _SPILL_BATCH:
+            pickle.dump(batch, files[i], pickle.HIGHEST_PROTOCOL)
+            batch.clear()
+    for f, batch in zip(files, batches):
+        if batch:
+            pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+
+def _defaultValueAB(op, key_a, key_b):
+    return (
+        (lambda x, y: (x, y))   if key_a or key_b or issubclass(op, (SetJoin, SortedSetJoin)) else
+        (lambda x, y: x if x is not None else y)
+        )
+
+def _runTagged(op, a, b, multiset, value_ab, kwargs):
+    # runs op on _Tagged items yielding (tag, value), tag ~ (0, a-position) or (1, b-position)
+    key_a   = kwargs.get('key_a')
+    key_b   = kwargs.get('key_b')
+    if key_a or key_b:
+        key_a   = key_a if key_a else (lambda x: x)
+        key_b   = key_b if key_b else (lambda y: y)
+        kwargs  = dict(kwargs, key_a = lambda t: key_a(t.item), key_b = lambda t: key_b(t.item))
+    def tagged_value_ab(tx, ty):
+        if tx is not None:
+            return (0, tx.tag), value_ab(tx.item, ty.item if ty is not None else None)
+        return (1, ty.tag), value_ab(None, ty.item)
+    return op(
+        (_Tagged(t, x) for t, x in a), (_Tagged(t, y) for t, y in b), multiset,
+        value_ab = tagged_value_ab, **kwargs
+        )
+
+class SpillingSetOp(SetOp):
+    # op(a, b, multiset, key_a = ..., key_b = ..., value_ab = ..., **kwargs) is any of the hash based operations,
+    # memory_limit ~ approximate number of bytes that b may take in memory (None = unlimited),
+    # partitions ~ number of partitions of b once spilled (None = derived from the size of b and memory_limit).
+    # A partition of b still larger than memory_limit is partitioned again (with its part of a) by another hash,
+    # unless it cannot be split (all of its keys equal).
+    _ENTRY_OVERHEAD = 100   # approximate bytes per item held in a hash table, apart from the item itself
+    _MAX_FANOUT     = 256   # partition files written at once
+    _HEADROOM       = 2     # partitions per memory_limit of b, for uneven ones
+
+    def __init__(self, op, a, b, multiset=False, key_a = None, key_b = None, value_ab = None,
+                 memory_limit = None, partitions = None, tempdir = None, **kwargs):
+        self.op         = op
+        self.multiset   = multiset
+        self.a          = a
+        self.b_parts    = None      # partition files of b once spilled
+        if key_a:
+            kwargs['key_a'] = key_a
+        if key_b:
+            kwargs['key_b'] = key_b
+        length  = len(b) if hasattr(b, '__len__') else None
+        b       = b.__iter__()
+        b_list  = []
+        size    = 0
+        for y in b:
+            b_list.append(y)
+            size += sys.getsizeof(y) + SpillingSetOp._ENTRY_OVERHEAD
+            if memory_limit is not None and size > memory_limit:
+                break
+        else:
+            # b fits into memory, no need to spill
+            if value_ab:
+                kwargs['value_ab'] = value_ab
+            self.in_memory  = op(a, b_list, multiset, **kwargs)
+            return
+        self.value_ab       = value_ab if value_ab else _defaultValueAB(op, key_a, key_b)
+        self.kwargs         = kwargs
+        self.tempdir        = tempdir
+        self.memory_limit   = memory_limit
+        self.key_b          = key_b if key_b else (lambda y: y)
+        n       = len(b_list)
+        tagged  = itertools.chain(enumerate(b_list), enumerate(b, n))
+        del b_list
+        if partitions is None and length is not None:
+            partitions = self._fanout(size * length // n, length)
+        if partitions is not None:
+            self.b_parts    = self._tempFiles(partitions)
+            self.b_sizes    = _spillSized(tagged, self.key_b, self.b_parts, 0)
+            return
+        # b of unknown size spilled as a whole first
+        with tempfile.TemporaryFile(dir = tempdir) as whole:
+            (size,), (n,)   = _spillSized(tagged, self.key_b, [whole], 0)
+            self.b_parts    = self._tempFiles(self._fanout(size, n))
+            self.b_sizes    = _spillSized(_readBatches(whole), self.key_b, self.b_parts, 0)
+
+    def _tempFiles(self, n):
+        return [tempfile.TemporaryFile(dir = self.tempdir) for __ in range(n)]
+
+    def _fanout(self, size, n):
+        # number of partitions of n items of size bytes of b
+        limit = max(self.memory_limit, 1)
+        return max(2, min(SpillingSetOp._MAX_FANOUT, n, -(-SpillingSetOp._HEADROOM * size // limit)))
+
+    def tableSizes(self):
+        return self.in_memory.tableSizes() if self.b_parts is None else {}
+
+    def _run(self, a_part, b_part, size, n, depth, results):
+        # appends the files of the results of a partition to results
+        key_a = self.kwargs.get('key_a', lambda x: x)
+        if size > self.memory_limit and n > 1:
+            b_parts = self._tempFiles(self._fanout(size, n))
+            sizes, counts = _spillSized(_readBatches(b_part), self.key_b, b_parts, depth + 1)
+            if max(counts) < n:
+                a_parts = self._tempFiles(len(b_parts))
+                _spillSized(_readBatches(a_part), key_a, a_parts, depth + 1)
+                a_part.close()
+                b_part.close()
+                for args in zip(a_parts, b_parts, sizes, counts):
+                    self._run(*args, depth + 1, results)
+                return
+            for f in b_parts:
+                f.close()   # one key only, processed as is
+        result = tempfile.TemporaryFile(dir = self.tempdir)
+        _writeBatches(result, _runTagged(
+            self.op, _readBatches(a_part), _readBatches(b_part), self.multiset, self.value_ab, self.kwargs
+            ))
+        a_part.close()
+        b_part.close()
+        results.append(result)
+
+    def __iter__(self):
+        if self.a is None:
+            raise LookupError('Cannot iterate more than once')
+        if self.b_parts is None:
+            yield from self.in_memory
+            self.a = None
+            return
+        key_a   = self.kwargs.get('key_a', lambda x: x)
+        a_parts = self._tempFiles(len(self.b_parts))
+        _spillSized(enumerate(self.a), key_a, a_parts, 0)
+        self.a  = None
+        results = []
+        for a_part, b_part, size, n in zip(a_parts, self.b_parts, *self.b_sizes):
+            self._run(a_part, b_part, size, n, 0, results)
+        self.b_parts = []
+        for __, value in heapq.merge(*(_readBatches(f) for f in results), key = itemgetter(0)):
+            yield value
+        for f in results:
+            f.close()
+
+# Multi-core execution: the worker processes read both inputs by ranges themselves (byte ranges of a LineFile, slices
+# of a list or tuple, other iterables are read into a list first) and write the items of each range by the hash of
+# their keys into partitions; op then runs on each partition, on the positions of the items in it (so that equal
+# items stay apart), and the results of each range are finally put into the input order again, by another worker
+# process each, so that they are just concatenated. Relies on the fork start method (so that the inputs, key and
+# value functions need not be picklable), runs op itself with a single job or where it is not available.
+
+class LineFile():
+    # lines of the file path, bytes or str decoded with encoding (an ASCII compatible one) with universal newlines
+    # as by open(), read by byte ranges of whole lines in the worker processes of ParallelSetOp
+    def __init__(self, path, encoding = None):
+        self.path       = path
+        self.encoding   = encoding
+
+    def __iter__(self):
+        with open(self.path, encoding = self.encoding) if self.encoding else open(self.path, 'rb') as f:
+            yield from f
+
+    def ranges(self, n):
+        # n (start, end) byte ranges, each starting at a line
+        size    = os.path.getsize(self.path)
+        starts  = [0]
+        with open(self.path, 'rb') as f:
+            for i in range(1, n):
+                f.seek(max(size * i // n - 1, starts[-1]))
+                if f.tell():
+                    f.readline()
+                starts.append(max(f.tell(), starts[-1]))
+        return list(zip(starts, starts[1:] + [size]))
+
+    def lines(self, start, end):
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start)
+        if self.encoding:
+            return io.StringIO(data.decode(self.encoding), newline = None).readlines()
+        return io.BytesIO(data).readlines()
+
+def _ranges(items, n):
+    if isinstance(items, LineFile):
+        return items.ranges(n)
+    return [(len(items) * i // n, len(items) * (i + 1) // n) for i in range(n)]
+
+def _partitionRange(config, side, r, start, end):
+    # writes the items of a range of an input by partition, followed by the partition of each item, returns the file
+    # offsets of the partitions and of the latter
+    items   = config['inputs'][side]
+    key     = config['keys'][side]
+    n       = config['partitions']
+    items   = items.lines(start, end) if isinstance(items, LineFile) else items[start:end]
+    parts   = bytes([h % n for h in map(hash, map(key, items) if key else items)])
+    chunks  = [[] for __ in range(n)]
+    appends = [chunk.append for chunk in chunks]
+    for p, x in zip(parts, items):
+        appends[p](x)
+    offsets = []
+    with open(os.path.join(config['directory'], 'ab'[side] + str(r)), 'wb') as f:
+        for chunk in chunks + [parts]:
+            offsets.append(f.tell())
+            pickle.dump(chunk, f, pickle.HIGHEST_PROTOCOL)
+    return offsets
+
+class _NoResults():
+    # the results of an item without any, pickled as a reference to _NO_RESULTS itself
+    def __reduce__(self):
+        return '_NO_RESULTS'
+
+_NO_RESULTS = _NoResults()
+
+class _Results(list):
+    # the results of an item with several ones
+    pass
+
+def _runPartition(config, p, offsets):
+    # runs op on a partition, offsets ~ those of its items in each range of a and b, writes the results of the items
+    # of each range (one per item: a value, _NO_RESULTS or _Results), returns their file offsets, whether b has any
+    # and whether any item has several
+    directory   = config['directory']
+    inputs      = ([], [])
+    sizes       = ([], [])
+    for side in (0, 1):
+        for r, offset in enumerate(offsets[side]):
+            with open(os.path.join(directory, 'ab'[side] + str(r)), 'rb') as f:
+                f.seek(offset)
+                chunk = pickle.load(f)
+            inputs[side].extend(chunk)
+            sizes[side].append(len(chunk))
+    items_a, items_b = inputs
+    slots_a, slots_b = slots = tuple([_NO_RESULTS] * len(items) for items in inputs)
+    found       = [False, False]    # results of b, items with several results
+    value       = config['value_ab']
+    def several(slots, i, v):
+        found[1]    = True
+        results     = slots[i]
+        if type(results) is _Results:
+            results.append(v)
+        else:
+            slots[i] = _Results((results, v))
+    def value_ab(i, j):
+        if i is not None:
+            v = value(items_a[i], items_b[j] if j is not None else None)
+            if slots_a[i] is _NO_RESULTS:
+                slots_a[i] = v
+            else:
+                several(slots_a, i, v)
+        else:
+            found[0] = True
+            v = value(None, items_b[j])
+            if slots_b[j] is _NO_RESULTS:
+                slots_b[j] = v
+            else:
+                several(slots_b, j, v)
+    key_a, key_b = config['keys']
+    kwargs      = dict(config['kwargs'],
+        key_a = (lambda i: key_a(items_a[i])) if key_a else items_a.__getitem__,
+        key_b = (lambda j: key_b(items_b[j])) if key_b else items_b.__getitem__
+        )
+    c           = config['op'](range(len(items_a)), range(len(items_b)), config['multiset'], value_ab = value_ab, **kwargs)
+    deque(c.iterBatches(), 0)
+    written     = ([], [])
+    with open(os.path.join(directory, 'r%i'%p), 'wb') as f:
+        for side in (0, 1):
+            start = 0
+            for size in sizes[side]:
+                written[side].append(f.tell())
+                pickle.dump(slots[side][start:start+size], f, pickle.HIGHEST_PROTOCOL)
+                start += size
+    return written, found[0], found[1]
+
+def _orderRange(config, side, r, offset, offsets, several):
+    # writes the results of the items of a range of an input in their order, offset ~ that of the partition of each
+    # item, offsets ~ those of the results of the range in each partition, returns the path of the file
+    directory   = config['directory']
+    with open(os.path.join(directory, 'ab'[side] + str(r)), 'rb') as f:
+        f.seek(offset)
+        parts   = pickle.load(f)
+    slots       = []
+    for p, offset in enumerate(offsets):
+        with open(os.path.join(directory, 'r%i'%p), 'rb') as f:
+            f.seek(offset)
+            slots.append(iter(pickle.load(f)).__next__)
+    results     = [slots[p]() for p in parts]
+    if several:
+        results = [v for results_ in results if results_ is not _NO_RESULTS
+                   for v in (results_ if type(results_) is _Results else (results_,))]
+    else:
+        results = [v for v in results if v is not _NO_RESULTS]
+    path        = os.path.join(directory, 'o%s%i'%('ab'[side], r))
+    with open(path, 'wb') as f:
+        _writeBatches(f, results)
+    return path
+
+# configuration of a worker process, set by the initializer of its pool (passed to the forked process as is, the
+# inputs, key and value functions need not be picklable)
+_worker_config = None
+
+def _workerInit(config):
+    global _worker_config
+    _worker_config = config
+
+def _workerPartitionRange(*args):
+    return _partitionRange(_worker_config, *args)
+
+def _workerRunPartition(*args):
+    return _runPartition(_worker_config, *args)
+
+def _workerOrderRange(args):
+    return _orderRange(_worker_config, *args)
+
+class ParallelSetOp(SetOp):
+    # op(a, b, multiset, key_a = ..., key_b = ..., value_ab = ..., **kwargs) is any of the hash based operations
+    # (SetIntersection ... SetJoin), run on partitions in jobs worker processes (os.cpu_count() if None), a and b are
+    # preferably LineFiles or lists, partitions ~ number of partitions and of ranges of each input (at most 256)
+    def __init__(self, op, a, b, multiset=False, key_a = None, key_b = None, value_ab = None,
+                 jobs = None, partitions = None, tempdir = None, **kwargs):
+        self.op         = op
+        self.multiset   = multiset
+        self.a          = a
+        self.b          = b
+        self.jobs       = jobs if jobs else os.cpu_count()
+        self.partitions = partitions if partitions else min(4 * self.jobs, 256)
+        if not 1 <= self.partitions <= 256:
+            raise ValueError('Number of partitions %r is not between 1 and 256'%self.partitions)
+        self.tempdir    = tempdir
+        self.keys       = (key_a, key_b)
+        self.value_ab   = value_ab if value_ab else _defaultValueAB(op, key_a, key_b)
+        if key_a:
+            kwargs['key_a'] = key_a
+        if key_b:
+            kwargs['key_b'] = key_b
+        self.kwargs     = kwargs
+
+    def __iter__(self):
+        for batch in self._batches():
+            yield from batch
+
+    def iterBatches(self, n = 1024):
+        # the batches of the results as written by the worker processes
+        return self._batches() if n >= _SPILL_BATCH else super().iterBatches(n)
+
+    def _batches(self):
+        if self.a is None:
+            raise LookupError('Cannot iterate more than once')
+        a, self.a = self.a, None
+        import multiprocessing  # not at startup, it imports socket
+        if self.jobs < 2 or 'fork' not in multiprocessing.get_all_start_methods():
+            yield from self.op(a, self.b, self.multiset, value_ab = self.value_ab, **self.kwargs).iterBatches()
+            return
+        inputs  = tuple(items if isinstance(items, (LineFile, list, tuple)) else list(items) for items in (a, self.b))
+        n       = self.partitions
+        with tempfile.TemporaryDirectory(dir = self.tempdir) as directory:
+            config = dict(
+                op = self.op, multiset = self.multiset, inputs = inputs, keys = self.keys, value_ab = self.value_ab,
+                kwargs = self.kwargs, partitions = n, directory = directory
+                )
+            with multiprocessing.get_context('fork').Pool(self.jobs, _workerInit, (config,)) as pool:
+                ranges  = [(side, r, start, end) for side in (0, 1)
+                           for r, (start, end) in enumerate(_ranges(inputs[side], n))]
+                written = pool.starmap(_workerPartitionRange, ranges)
+                written = (written[:n], written[n:])
+                run     = pool.starmap(_workerRunPartition,
+                                       [(p, [[offsets[p] for offsets in written[side]] for side in (0, 1)])
+                                        for p in range(n)])
+                several = any(several for __, __, several in run)
+                order   = [(side, r, written[side][r][n], [results[side][r] for results, __, __ in run], several)
+                           for side in ((0, 1) if any(b for __, b, __ in run) else (0,)) for r in range(n)]
+                for path in pool.imap(_workerOrderRange, order):
+                    with open(path, 'rb') as f:
+                        while True:
+                            try:
+                                yield pickle.load(f)
+                            except EOFError:
+                                break
+                    os.remove(path)
+
+# Vectorized execution with NumPy: the keys of both inputs are loaded into a single array of 64-bit integers, either
+# int keys themselves, ASCII str/bytes keys of at most 8 bytes (as fixed-width words) or longer ones that are all
+# canonical decimal integers (so that e.g. '007' and '7' stay different) of up to 18 digits.
+# Occurrences of each key are then ranked by sorting, the i-th occurrence of a key in a matching the i-th one
+# in b (the one that the multisets would pop), so the results are those of op in the same order; only value_ab is
+# called per result. Both inputs are held in memory. Falls back to op itself if NumPy is not installed or the keys
+# do not qualify (longer strings are hashed faster by Python itself than sorted by NumPy).
+# NumPy is imported on the first use only (it takes longer than the rest of the startup).
+
+numpy           = None      # set by _importNumpy()
+_numpy_imported = False
+
+def _importNumpy():
+    # NumPy, None if it is not installed
+    global numpy, _numpy_imported
+    if not _numpy_imported:
+        _numpy_imported = True
+        try:
+            import numpy
+        except ImportError:
+            pass
+    return numpy
+
+def _decimals(strings, lengths):
+    # int64 array of the numbers in a bytes array (of the given lengths), None unless they are all canonical
+    n, width    = len(strings), strings.itemsize
+    chars       = strings.view(numpy.uint8).reshape(n, width)
+    negative    = chars[:, 0] == ord('-')
+    digits      = lengths - negative
+    if width > 19 or not n or digits.min() < 1 or digits.max() > 18:
+        return None
+    values      = numpy.zeros(n, numpy.int64)
+    for j in range(width):
+        inside  = j < lengths
+        if j == 0:
+            inside &= ~negative
+        d       = chars[:, j].astype(numpy.int64) - ord('0')
+        if (inside & ((d < 0) | (d > 9))).any():
+            return None
+        values  = numpy.where(inside, 10 * values + d, values)
+    first       = chars[numpy.arange(n), negative.astype(numpy.intp)]
+    if ((first == ord('0')) & ((digits > 1) | negative)).any():
+        return None     # leading zeros, -0
+    return numpy.where(negative, -values, values)
+
+def _keyArray(keys):
+    # array of the keys, None if they do not qualify
+    types = set(map(type, keys))
+    if len(types) != 1:
+        return None
+    if types == {int}:
+        try:
+            return numpy.array(keys, numpy.int64)
+        except OverflowError:
+            return None
+    if types != {str} and types != {bytes}:
+        return None
+    try:
+        strings = numpy.array(keys, 'S')
+    except UnicodeEncodeError:
+        return None
+    lengths = numpy.fromiter(map(len, keys), numpy.int64, len(keys))
+    if (numpy.char.str_len(strings) != lengths).any():
+        return None     # trailing NULs, which NumPy strings drop
+    if strings.itemsize <= 8:
+        return strings.astype('S8').view(numpy.uint64)
+    return _decimals(strings, lengths)
+
+def _ranked(keys, n_a):
+    # for the keys of a followed by those of b: the number of each (distinct) key, the rank of each item among the
+    # items with the same key in the same input, the number of items with each number in a and in b, the positions
+    # of the items sorted (stably) by key and the position in there of the first item of b with each number; the
+    # items of a precede those of b with the same key once sorted, as they precede them in keys
+    order   = numpy.argsort(keys)
+    sorted_ = keys[order]
+    first   = numpy.empty(len(keys), bool)
+    first[:1]   = True
+    first[1:]   = sorted_[1:] != sorted_[:-1]
+    numbers = numpy.cumsum(first) - 1
+    order   = order[numpy.argsort(numbers * len(keys) + order)]    # stable, faster than a stable sort of keys
+    starts  = numpy.flatnonzero(first)
+    in_a    = order < n_a
+    counts_a    = numpy.bincount(numbers[in_a], minlength = len(starts))
+    counts_b    = numpy.diff(numpy.append(starts, len(keys))) - counts_a
+    ranks   = numpy.arange(len(keys)) - starts[numbers]
+    ranks[~in_a] -= counts_a[numbers[~in_a]]
+    ids     = numpy.empty_like(numbers)
+    ids[order]          = numbers
+    ranks[order]        = ranks.copy()
+    return ids, ranks, counts_a, counts_b, order, starts + counts_a
+
+class ArraySetOp(SetOp):
+    # op(a, b, multiset, key_a = ..., key_b = ..., value_ab = ..., **kwargs) is any of the hash based operations
+    # (SetIntersection ... SetJoin), vectorized = whether NumPy has been used (known once iterated)
+    def __init__(self, op, a, b, multiset=False, key_a = None, key_b = None, value_ab = None, **kwargs):
+        self.op         = op
+        self.multiset   = multiset
+        self.a          = a
+        self.b          = b
+        self.key_a      = key_a
+        self.key_b      = key_b
+        self.value_ab   = value_ab
+        self.kwargs     = kwargs
+        self.vectorized = False
+
+    def _fallback(self, a, b):
+        kwargs = dict(self.kwargs)
+        if self.value_ab:
+            kwargs['value_ab'] = self.value_ab
+        return self.op(a, b, self.multiset, self.key_a, self.key_b, **kwargs)
+
+    def __iter__(self):
+        for batch in self.iterBatches():
+            yield from batch
+
+    def iterBatches(self, n = 1024):
+        if self.a is None:
+            raise LookupError('Cannot iterate more than once')
+        a, b, self.a, self.b = self.a, self.b, None, None
+        if (_importNumpy() is None or isinstance(b, SetIndex) or self.kwargs.get('multiplicity') or
+            self.op not in (SetIntersection, SetUnion, SetDifference, SetSymmetricDifference, SetJoin) or
+            not set(self.kwargs) <= {'left', 'build', 'unique_check', 'multiplicity'}):
+            return self._fallback(a, b).iterBatches(n)
+        a       = list(a)
+        b       = list(b)
+        keys_a  = list(map(self.key_a, a)) if self.key_a else a
+        keys_b  = list(map(self.key_b, b)) if self.key_b else b
+        keys    = _keyArray(keys_a + keys_b) if a or b else None
+        if keys is None:
+            return self._fallback(a, b).iterBatches(n)
+        self.vectorized = True
+        ids, ranks, counts_a, counts_b, order, firsts_b = _ranked(keys, len(a))
+        ids_a, ids_b        = ids[:len(a)], ids[len(a):]
+        ranks_a, ranks_b    = ranks[:len(a)], ranks[len(a):]
+        if not self.multiset:
+            for ranks, keys_ in ((ranks_b, keys_b), (ranks_a, keys_a)):
+                duplicates = numpy.flatnonzero(ranks)
+                if len(duplicates):
+                    raise ValueError('Value %r appears more than once in the set'%(keys_[duplicates[0]],))
+        value_ab    = self.value_ab if self.value_ab else _defaultValueAB(self.op, self.key_a, self.key_b)
+        matched     = ranks_a < counts_b[ids_a]     # items of a with their (next) occurrence in b
+        i           = numpy.flatnonzero(matched)
+        matches     = numpy.full(len(a), -1)
+        matches[i]  = order[firsts_b[ids_a[i]] + ranks_a[i]] - len(a)
+        return self._batches(n, a, b, ids_a, ids_b, ranks_b, counts_a, counts_b, order, firsts_b, matched, matches,
+                             value_ab)
+
+    def _batches(self, n, a, b, ids_a, ids_b, ranks_b, counts_a, counts_b, order, firsts_b, matched, matches,
+                 value_ab):
+        op = self.op
+        if op == SetJoin:
+            left    = self.kwargs.get('left', False)
+            b_order = (order - len(a)).tolist()
+            batch   = []
+            for x, first, m in zip(a, firsts_b[ids_a].tolist(), counts_b[ids_a].tolist()):
+                if m:
+                    batch.extend([value_ab(x, b[j]) for j in b_order[first:first+m]])
+                elif left:
+                    batch.append(value_ab(x, None))
+                if len(batch) >= n:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+            return
+        if op == SetIntersection:
+            i = numpy.flatnonzero(matched)
+            for s in range(0, len(i), n):
+                yield [value_ab(a[i], b[j]) for i, j in zip(i[s:s+n].tolist(), matches[i[s:s+n]].tolist())]
+        elif op == SetUnion:
+            for s in range(0, len(a), n):
+                yield [value_ab(x, b[j] if j >= 0 else None) for x, j in zip(a[s:s+n], matches[s:s+n].tolist())]
+        else:
+            i = numpy.flatnonzero(~matched)
+            for s in range(0, len(i), n):
+                yield [value_ab(a[i], None) for i in i[s:s+n].tolist()]
+        if op in (SetUnion, SetSymmetricDifference):
+            # the occurrences of b not consumed by those of a
+            j = numpy.flatnonzero(ranks_b >= counts_a[ids_b])
+            for s in range(0, len(j), n):
+                yield [value_ab(None, b[j]) for j in j[s:s+n].tolist()]
+
+# Aggregation of the values of items by their keys, yielding (key, result) pairs (a set by key, which may be used as
+# either input of the set operations with key itemgetter(0)), result depends on the method:
+#   count               number of items
+#   list                [value, ...]
+#   count-list          (number of items, [value, ...])
+#   count-count-list    (number of items, [(value, number of items with the value), ...])
+# values and distinct values in order of their first occurrence
+
+AGGREGATE_METHODS = ('count', 'list', 'count-list', 'count-count-list')
+
+class Aggregate():
+    def __init__(self, items, key = None, value = None, method = 'count'):
+        if method not in AGGREGATE_METHODS:
+            raise ValueError('Unknown aggregation method %r'%method)
+        self.items  = items
+        self.key    = key   if key      else (lambda x: x)
+        self.value  = value if value    else (lambda x: x)
+        self.method = method
+
+    def _items(self):
+        if self.items is None:
+            raise LookupError('Cannot iterate more than once')
+        items, self.items = self.items, None
+        return items
+
+class HashAggregate(Aggregate):
+    # keys in the order of their first occurrence, the state is a single dict (of counts for count)
+    def __iter__(self):
+        items   = self._items()
+        key     = self.key
+        value   = self.value
+        if self.method == 'count':
+            yield from Counter(map(key, items)).items()
+        elif self.method == 'count-count-list':
+            groups = {}
+            for x in items:
+                k = key(x)
+                g = groups.get(k)
+                if g is None:
+                    g = groups[k] = Counter()
+                g[value(x)] += 1
+            for k, g in groups.items():
+                yield k, (sum(g.values()), list(g.items()))
+        else:
+            groups = {}
+            for x in items:
+                k = key(x)
+                g = groups.get(k)
+                if g is None:
+                    groups[k] = [value(x)]
+                else:
+                    g.append(value(x))
+            if self.method == 'list':
+                yield from groups.items()
+            else:
+                for k, g in groups.items():
+                    yield k, (len(g), g)
+
+class SortedAggregate(Aggregate):
+    # items sorted by key, in constant memory (apart from the values of a single key for the list methods),
+    # ValueError as soon as the input turns out not to be sorted
+    def __iter__(self):
+        value = self.value
+        for k, group in groupby(_sortedKeys(self._items(), self.key, False), itemgetter(0)):
+            if self.method == 'count':
+                yield k, sum(1 for __ in group)
+            elif self.method == 'count-count-list':
+                g = Counter(value(x) for __, x in group)
+                yield k, (sum(g.values()), list(g.items()))
+            else:
+                g = [value(x) for __, x in group]
+                yield k, (g if self.method == 'list' else (len(g), g))
+
+# Instrumentation of a run: time spent in phases (build ~ constructing the operations, which reads and hashes their b,
+# probe ~ iterating them, write ~ writing the results), numbers of items read from the inputs and produced by the
+# operations, and for each operation (step) its hits and misses (lookups of items of a in b that found it or not; an
+# N-ary union looks up the items of all its inputs among those of the earlier ones), duplicates in b and sizes of the
+# tables it builds. Costs a generator step per counted item, so it is meant to be left out rather than disabled.
+
+def _hitsMisses(op, n_a, n_b, n):
+    # (hits, misses) of the operation op (a class) given the numbers of items of a, b (all the bs of an N-ary
+    # operation) and of the results, (None, None) if not known
+    if n_a is None or n is None:
+        return None, None
+    if issubclass(op, (SetIntersection, SortedSetIntersection, NarySetIntersection)):
+        return n, n_a - n
+    if issubclass(op, (SetDifference, SortedSetDifference)):
+        return n_a - n, n
+    if n_b is None:
+        return None, None
+    if issubclass(op, NarySetUnion):
+        return n_a + n_b - n, n
+    if issubclass(op, (SetUnion, SortedSetUnion)):
+        return n_a + n_b - n, n - n_b
+    if issubclass(op, (SetSymmetricDifference, SortedSetSymmetricDifference)):
+        hits = (n_a + n_b - n) // 2
+        return hits, n_a - hits
+    return None, None
+
+class SetStats():
+    def __init__(self):
+        self.start      = time.perf_counter()
+        self.seconds    = {}    # phase -> seconds
+        self.counts     = {}    # name of an input or results -> [number of items]
+        self.inputs     = []    # names of the inputs
+        self.steps      = []    # (name, class, operation, names of its a, b (a list of them for an N-ary operation)
+                                #  and results, table sizes once built)
+
+    @contextlib.contextmanager
+    def timed(self, phase):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[phase] = self.seconds.get(phase, 0.0) + time.perf_counter() - t
+
+    def counted(self, name, items):
+        # items counted as they are read
+        return self._counted(self.counts.setdefault(name, [0]), items)
+
+    def _counted(self, count, items):
+        for x in items:
+            count[0] += 1
+            yield x
+
+    def input(self, name, items):
+        self.inputs.append(name)
+        return self.counted(name, items)
+
+    def add(self, name, n):
+        self.counts.setdefault(name, [0])[0] += n
+
+    def step(self, name, op, operation, a, b, results):
+        # op ~ class of the operation (e.g. SetIntersection for a SpillingSetOp of it), a, b, results ~ names of the
+        # counts of its inputs and results, b a list of names for an N-ary operation
+        self.steps.append((name, op, operation, a, b, results, operation.tableSizes()))
+
+    def report(self):
+        total   = time.perf_counter() - self.start
+        counts  = {name: count[0] for name, count in self.counts.items()}
+        steps   = []
+        for name, op, operation, a, b, results, built in self.steps:
+            nary    = isinstance(b, list)
+            n_bs    = [counts.get(name_b) for name_b in b] if nary else [counts.get(b)]
+            n_b     = sum(n_bs) if None not in n_bs else None
+            hits, misses = _hitsMisses(op, counts.get(a), n_b, counts.get(results))
+            tables  = dict(operation.tableSizes())
+            if 'b' in built:
+                tables['b'] = built['b']    # b shrinks while probed by some operations
+            steps.append({
+                'name':         name,
+                'hits':         hits,
+                'misses':       misses,
+                'duplicates_b': n_b - tables['b'] if not nary and n_b is not None and 'b' in tables else None,
+                'table_sizes':  tables,
+                })
+        peak = None
+        if resource is not None:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            peak = peak if sys.platform == 'darwin' else 1024 * peak    # bytes on macOS, KiB elsewhere
+        n = sum(counts[name] for name in self.inputs)
+        return {
+            'seconds':          dict(self.seconds, total = total),
+            'items':            counts,
+            'items_per_second': n / total if total > 0 else None,
+            'peak_memory':      peak,
+            'steps':            steps,
+            }
+
+    def json(self):
+        return json.dumps(self.report())
+
+    def text(self):
+        # lines of a summary
+        r       = self.report()
+        lines   = [
+            'time: ' + ', '.join('%s %.3f s'%item for item in r['seconds'].items()),
+            'items: ' + ', '.join('%s %i'%item for item in r['items'].items()) + (
+                ' (%.0f input items/s)'%r['items_per_second'] if r['items_per_second'] is not None else ''),
+            ]
+        if r['peak_memory'] is not None:
+            lines.append('peak memory: %.1f MiB'%(r['peak_memory'] / 2**20))
+        for step in r['steps']:
+            fields = ['%i %s'%(step[name], label) for name, label in (
+                ('hits', 'hits'), ('misses', 'misses'), ('duplicates_b', 'duplicates in b')
+                ) if step[name] is not None]
+            fields += ['table of %s %i keys'%item for item in sorted(step['table_sizes'].items(), reverse = True)]
+            lines.append('%s: %s'%(step['name'], ', '.join(fields) if fields else 'no statistics'))
+        return lines
+
+# Set server: indexes of b files (SetIndex of their lines as bytes) built once and kept in memory, probed by any
+# number of concurrent clients over a Unix socket. The event loop reads a and writes the results of each request,
+# whose batches of a are computed in threads.
+# A request is a line of JSON followed by the lines of a up to the end of the client's output:
+#   {"op": <key of SERVER_OPS>, "set": <name>, "path": <real path of the file of the set or null>,
+#    "fields": <0-based indices of the key fields of a or null>, "fields_b": <the same for b>,
+#    "separator": <str>, "multiset": <bool>, "left": <bool, for joins>}
+# The response is a sequence of frames, each a type byte, the 4-byte length and the payload: b'R' (ready, a may be
+# sent), b'N' (no such set, or not loaded as requested), b'D' (lines of results), b'Z' (the end of the results) or
+# b'E' (JSON {"message": ..., "status": 1 for ValueError, 2 otherwise}, the last frame).
+# Sets are looked up by path if the client gives one, by name otherwise, and reloaded once their files change.
+# The results are those of the operations with value_ab returning the line of a or b, joined lines are the line of a
+# (without its new line), the separator and the line of b.
+# asyncio, socket and threading are imported by the methods using them, sparing tsetop their import otherwise.
+
+SERVER_OPS = {
+    'intersection':         SetIntersection,
+    'union':                SetUnion,
+    'difference':           SetDifference,
+    'symmetric-difference': SetSymmetricDifference,
+    'join':                 SetJoin,
+    }
+
+SERVER_READ = 1 << 16
+
+_FRAME = struct.Struct('>cI')
+
+def _splitLines(rest, chunk):
+    # (the whole lines of rest + chunk, the rest of it)
+    data    = rest + chunk
+    i       = data.rfind(b'\n') + 1
+    return io.BytesIO(data[:i]).readlines() if i else [], data[i:]
+
+def _fileLines(f):
+    # lines of the binary file f, a new line added to the last one if missing
+    rest = b''
+    for chunk in iter(lambda: f.read(1 << 20), b''):
+        lines, rest = _splitLines(rest, chunk)
+        yield from lines
+    if rest:
+        yield rest + b'\n'
+
+def _serverKey(fields, sep):
+    return fieldKey(fields[0] if len(fields) == 1 else fields, sep, b'\n') if fields is not None else None
+
+class _ServedSet():
+    def __init__(self, path, fields, separator, multiset):
+        self.path       = path
+        self.fields     = fields
+        self.separator  = separator
+        self.multiset   = multiset
+        self.stat       = _sourceStat(path)
+        with open(path, 'rb') as f:
+            self.index  = SetIndex(_fileLines(f), _serverKey(fields, separator), multiset)
+
+class SetServer():
+    # fields ~ 0-based indices of the key fields of the sets (None for whole lines) separated by separator (bytes)
+    def __init__(self, fields = None, separator = b'\t', multiset = False):
+        self.fields     = fields
+        self.separator  = separator
+        self.multiset   = multiset
+        self.sets       = {}    # name -> _ServedSet
+        self.paths      = {}    # real path -> name
+        self.locks      = {}    # name -> asyncio.Lock of its reloads
+
+    def load(self, name, path):
+        # (re)builds the index of the set name from the file path
+        s = _ServedSet(path, self.fields, self.separator, self.multiset)
+        self.sets[name] = s
+        self.paths[os.path.realpath(path)] = name
+        return s
+
+    async def _set(self, request):
+        # the set of the request (reloaded if its file has changed), None if there is none to match it
+        import asyncio
+        name    = self.paths.get(request.get('path')) if request.get('path') else request.get('set')
+        if name not in self.sets:
+            return None
+        async with self.locks.setdefault(name, asyncio.Lock()):
+            s = self.sets[name]
+            try:
+                fresh = _sourceStat(s.path) == s.stat
+            except OSError:
+                fresh = True    # removed, the loaded version served
+            if not fresh:
+                s = await asyncio.to_thread(self.load, name, s.path)
+        sep = request.get('separator', '\t').encode('utf-8', 'surrogateescape')
+        if s.multiset != bool(request.get('multiset')) or s.fields != request.get('fields_b') or \
+           s.fields is not None and s.separator != sep:
+            return None
+        return s
+
+    def _operation(self, request, s):
+        # IncrementalSetOp of the request fed by the batches of a as they come
+        op = SERVER_OPS.get(request.get('op'))
+        if op is None:
+            raise ValueError('Unknown operation %r'%request.get('op'))
+        sep     = request.get('separator', '\t').encode('utf-8', 'surrogateescape')
+        fields  = request.get('fields')
+        key_a   = _serverKey(fields, sep)
+        if fields is not None and s.fields is None:
+            key_field = key_a
+            key_a = lambda x: key_field(x) + b'\n'  # the keys of the set are whole lines
+        elif fields is None and s.fields is not None:
+            key_a = _lineKey
+        if op is SetJoin:
+            value_ab = lambda x, y: x[:-1] + sep + y if y is not None else x
+            return IncrementalSetOp(SetJoin, s.index, s.multiset, key_a, value_ab, left = bool(request.get('left')))
+        return IncrementalSetOp(op, s.index, s.multiset, key_a, _xOrY)
+
+    async def _handle(self, reader, writer):
+        # a read and the results written by the event loop, each batch of a (up to SERVER_READ bytes) computed in a
+        # thread of the default executor, which none of the connections holds while waiting for its client
+        import asyncio
+        async def send(kind, payload = b''):
+            writer.writelines((_FRAME.pack(kind, len(payload)), payload))
+            await writer.drain()
+        try:
+            try:
+                request = json.loads(await reader.readline())
+                s       = await self._set(request)
+                if s is None:
+                    await send(b'N')
+                    return
+                await send(b'R')
+                c       = self._operation(request, s)
+                rest    = b''
+                while True:
+                    chunk = await reader.read(SERVER_READ)
+                    if not chunk:
+                        lines   = [rest + b'\n'] if rest else []
+                    else:
+                        lines, rest = _splitLines(rest, chunk)
+                    if lines:
+                        results = await asyncio.to_thread(c.feed, lines)
+                        if results:
+                            await send(b'D', b''.join(results))
+                    if not chunk:
+                        break
+                results = await asyncio.to_thread(c.finish)
+                for batch in batches(results):
+                    await send(b'D', b''.join(batch))
+                await send(b'Z')
+            except ValueError as e:
+                await send(b'E', json.dumps({'message': str(e), 'status': 1}).encode())
+            except ConnectionError:
+                raise
+            except Exception as e:
+                await send(b'E', json.dumps({'message': str(e), 'status': 2}).encode())
+        except ConnectionError:
+            pass    # the client is gone
+        except asyncio.CancelledError:
+            pass    # the server is stopping, ended as the others (Python 3.11 logs the cancelled handlers)
+        finally:
+            writer.close()
+
+    async def serve(self, path):
+        # serves the sets on the Unix socket path (a stale one replaced) until cancelled
+        import asyncio, socket
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                if s.connect_ex(path) == 0:
+                    raise OSError('Socket %r is in use'%path)
+            os.unlink(path)
+        server = await asyncio.start_unix_server(self._handle, path)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            os.unlink(path)
+
+    def run(self, path, signals = ()):
+        # serves until one of signals is received, handled by the event loop, which then closes the connections
+        # (without a KeyboardInterrupt raised wherever the signal happens to arrive)
+        import asyncio
+        async def main():
+            task = asyncio.current_task()
+            for signum in signals:
+                asyncio.get_running_loop().add_signal_handler(signum, task.cancel)
+            try:
+                await self.serve(path)
+            except asyncio.CancelledError:
+                pass
+        asyncio.run(main())
+
+class SetClient():
+    # a request (as in SetServer) to the server on the Unix socket path; LookupError if the server has no set to
+    # match it, OSError if it cannot be reached
+    def __init__(self, path, request):
+        import socket
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.socket.connect(path)
+            self.socket.sendall(json.dumps(request).encode() + b'\n')
+            self.f      = self.socket.makefile('rb')
+            kind, __    = self._frame()
+        except BaseException:
+            self.socket.close()
+            raise
+        if kind != b'R':
+            self.close()
+            raise LookupError('Set %r not loaded by the server'%request.get('set'))
+
+    def _frame(self):
+        header = self.f.read(_FRAME.size)
+        if len(header) < _FRAME.size:
+            raise ConnectionError('Connection closed by the server')
+        kind, n = _FRAME.unpack(header)
+        payload = self.f.read(n)
+        if len(payload) < n:
+            raise ConnectionError('Connection closed by the server')
+        if kind == b'E':
+            error = json.loads(payload)
+            raise (ValueError if error['status'] == 1 else OSError)(error['message'])
+        return kind, payload
+
+    def results(self, a):
+        # bytes of lines of the results for a, bytes of its lines (or chunks thereof), sent by a background thread;
+        # ValueError or OSError for errors of the server
+        import socket, threading
+        errors = []
+        def send():
+            try:
+                for chunk in a:
+                    self.socket.sendall(chunk, getattr(socket, 'MSG_NOSIGNAL', 0))
+                self.socket.shutdown(socket.SHUT_WR)
+            except Exception as e:
+                errors.append(e)
+                with contextlib.suppress(OSError):
+                    self.socket.shutdown(socket.SHUT_RDWR)  # ends the results as well
+        thread = threading.Thread(target = send, daemon = True)
+        thread.start()
+        try:
+            while True:
+                try:
+                    kind, payload = self._frame()
+                except ConnectionError:
+                    thread.join()
+                    if errors:
+                        raise errors[0]
+                    raise
+                if kind == b'Z':
+                    break
+                yield payload
+        finally:
+            if thread.is_alive():
+                # e.g. after an error of the server, which no longer reads a
+                with contextlib.suppress(OSError):
+                    self.socket.shutdown(socket.SHUT_RDWR)
+            thread.join()   # not closed while sent to (its descriptor could be reused meanwhile)
+            self.close()
+
+    def close(self):
+        self.f.close()
+        self.socket.close()
@@ -1,7 +1,19 @@
+import bz2
+import gzip
+import json
+import lzma
+import os
+import select
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 import setop
 from setop import *
 from collections import Counter
+from operator import itemgetter
 
 
 abcdf_order0        = 'abbcccddddffff'
@@ -102,6 +114,63 @@ class BasicClassesTestCase(unittest.TestCase):
     def test_OrderedMultiset_pop_iter(self):
         self.do_test_OrderedMultiset_remove_iter(lambda a,x: a.pop(x))
 
+    def test_fieldKey(self):
+        for sep, nl in (('\t', '\n'), (b'\t', b'\n'), ('::', '\n')):
+            cast = (lambda x: x.encode()) if type(sep) == bytes else (lambda x: x)
+            line = cast('a%sbb%sccc\n'%(sep, sep) if type(sep) == str else 'a\tbb\tccc\n')
+            self.assertEqual(fieldKey(0, sep, nl)(line), cast('a'))
+            self.assertEqual(fieldKey(1, sep, nl)(line), cast('bb'))
+            self.assertEqual(fieldKey(2, sep, nl)(line), cast('ccc'))
+            self.assertEqual(fieldKey((2, 0), sep, nl)(line), (cast('ccc'), cast('a')))
+            self.assertEqual(fieldKey(0, sep, nl)(cast('abc\n')), cast('abc'))
+            self.assertEqual(fieldKey(0, sep, nl)(cast('abc')), cast('abc'))
+            self.assertEqual(fieldKey(1, sep, nl)(line[:-1]), cast('bb'))
+            with self.assertRaises(ValueError):
+                fieldKey(3, sep, nl)(line)
+            with self.assertRaises(ValueError):
+                fieldKey((0, 3), sep, nl)(line)
+
+    def test_OrderedMultiset_any_items(self):
+        items = [1, (1, 2), 'a', 1, None, (1, 2), 2, 1]
+        oms = setop._OrderedMultiset(items)
+        self.assertEqual(list(oms), items)
+        self.assertEqual(oms.pop(1), 1)
+        oms.remove((1, 2))
+        self.assertEqual(oms.pop(None), None)
+        self.assertEqual(list(oms), ['a', 1, (1, 2), 2, 1])
+        self.assertEqual(oms.keyCounts(), {1: 2, (1, 2): 1, 'a': 1, 2: 1})
+
+    def test_OrderedMultiset_key(self):
+        r = range(10)
+        oms = setop._OrderedMultiset(r, key = lambda x: x % 3)
+        self.assertEqual(oms[1], 1)
+        self.assertEqual(oms.pop(1), 1)
+        self.assertEqual(oms.pop(1), 4)
+        self.assertNotIn(3, oms)
+        self.assertEqual(list(oms), [0, 2, 3, 5, 6, 7, 8, 9])
+
+    def test_OrderedMultiset_copy(self):
+        oms = setop._OrderedMultiset(abcdf_order0)
+        c = oms.copy()
+        for x in abcdf_order0:
+            c.remove(x)
+        self.assertEqual(list(c), [])
+        self.assertEqual(''.join(oms), abcdf_order0)
+
+    def test_OrderedMultiset_wide(self):
+        # the index arrays are widened once an index does not fit
+        wide, setop._WIDE_INDEX = setop._WIDE_INDEX, 3
+        try:
+            oms = setop._OrderedMultiset(abcdf_order0 * 2)
+        finally:
+            setop._WIDE_INDEX = wide
+        self.assertEqual((oms.links.typecode, oms.heads.typecode), ('q', 'q'))
+        c = oms.copy()
+        for x in abcdf_order0:
+            c.remove(x)
+        self.assertEqual(''.join(c), abcdf_order0)
+        self.assertEqual(''.join(oms), abcdf_order0 * 2)
+
 class SetOpsTestCase(unittest.TestCase):
     def __init__(self,*args,**kwargs):
         super().__init__(*args, **kwargs)
@@ -131,10 +200,7 @@ class SetOpsTestCase(unittest.TestCase):
                         for key_b, key_b_dup in zip(keys, keys_dup):
                             for value_ab in (None, lambda a, b: a+b):
                                 for b_as_is in (True, False):
-                                    if (
-                                        multiset and (key_a or key_b) or                    # keys not allowed for multiset
-                                        not (multiset or b_as_is) and (b_dup or (key_b_dup and len(b)>=2))  # uniqueness check for b fails
-                                        ):
+                                    if not (multiset or b_as_is) and (b_dup or (key_b_dup and len(b)>=2)):  # uniqueness check for b fails
                                         self.assertRaises(ValueError, SetOp,  a, b, multiset, key_a, key_b, value_ab, b_as_is)
                                     else:
                                         SetOp(a, b, multiset, key_a, key_b, value_ab, b_as_is)
@@ -191,6 +257,21 @@ class SetOpsTestCase(unittest.TestCase):
             with self.assertRaises(LookupError):
                 [x for x in c]      # should not be able to iterate again
             
+    def test_keys_all_ops(self):
+        a = ['%i\ta'%x for x in self.num_a]
+        b = ['b\t%i'%x for x in self.num_b]
+        key_a, key_b = fieldKey(0), fieldKey(1)
+        value_ab = lambda x, y: x if x is not None else y
+        for m in (False, True):
+            for op in (SetIntersection, SetUnion, SetDifference, SetSymmetricDifference):
+                self.assertEqual(
+                    list(op(a, b, m, key_a, key_b, value_ab)),
+                    [x if type(x) == str else y for x, y in op(self.num_a, self.num_b, m, str, str) for x, y in [(
+                        None if x is None else '%i\ta'%x, None if y is None else 'b\t%i'%y
+                        )]]
+                    )
+        self.assertEqual(list(SetSymmetricDifference('ab', 'bc', False, str.upper, str.upper)), [('a', None), (None, 'c')])
+
     def test_M_all_except_join(self):
         for a in all_strings:
             ac = Counter(a)
@@ -244,11 +325,11 @@ class SetOpsTestCase(unittest.TestCase):
     def test_uniqueness_check(self):
         dup0 = list(self.num_r)+[0]
         # All operations (including join without keys)
-        for setop in (SetIntersection, SetUnion, SetDifference, SetSymmetricDifference, SetJoin):
-            c = setop(dup0, self.num_r)
+        for op in (SetIntersection, SetUnion, SetDifference, SetSymmetricDifference, SetJoin):
+            c = op(dup0, self.num_r)
             with self.assertRaises(ValueError):
                 [x for x in c]      # duplicate value in the udnerlying set -> ValueError when iterating
-            c = setop(dup0, self.num_r, True)
+            c = op(dup0, self.num_r, True)
             [x for x in c]          # multiset, no error
         # Join, duplicate by key:
         c = SetJoin(self.num_r, self.num_r, key_a = lambda x: 0 if x==42 else x)
@@ -258,6 +339,934 @@ class SetOpsTestCase(unittest.TestCase):
             c = SetJoin(self.num_r, self.num_r, key_b = lambda x: 0 if x==42 else x)
             [x for x in c]      # duplicate value in the udnerlying set -> ValueError when iterating
        
+class SortedSetOpsTestCase(unittest.TestCase):
+    def test_same_as_hashed(self):
+        for a in all_strings:
+            for b in all_strings:
+                sa, sb = sorted(a), sorted(b)
+                for m in (False, True):
+                    if not m and (len(set(a)) < len(a) or len(set(b)) < len(b)):
+                        continue
+                    for (op, sop) in (
+                        (SetIntersection,           SortedSetIntersection),
+                        (SetUnion,                  SortedSetUnion),
+                        (SetDifference,             SortedSetDifference),
+                        (SetSymmetricDifference,    SortedSetSymmetricDifference),
+                        ):
+                        c = list(sop(sa, sb, m))
+                        self.assertEqual(c, sorted(op(sa, sb, m)))
+                        self.assertEqual(c, sorted(c))
+
+    def test_SortedSetJoin(self):
+        r = range(100)
+        for left in (False, True):
+            c = SortedSetJoin(r, r, True, key_a = (lambda x: x//2), key_b = (lambda x: x//3), left = left)
+            d = SetJoin(r, r, True, key_a = (lambda x: x//2), key_b = (lambda x: x//3), left = left)
+            self.assertEqual(list(c), list(d))
+            with self.assertRaises(LookupError):
+                [x for x in c]
+        c = SortedSetJoin(r, r, key_a = (lambda x: x*2), key_b = (lambda x: x*3), left = True)
+        self.assertEqual(list(c), [(x, x*2//3 if x % 3 == 0 else None) for x in r])
+
+    def test_not_sorted(self):
+        for op in (SortedSetIntersection, SortedSetUnion, SortedSetDifference, SortedSetSymmetricDifference, SortedSetJoin):
+            for m in (False, True):
+                with self.assertRaises(ValueError):
+                    [x for x in op('abdc', 'abcd', m)]
+                with self.assertRaises(ValueError):
+                    [x for x in op('abcd', 'acbd', m)]
+            with self.assertRaises(ValueError):
+                [x for x in op('abbc', 'abcd')]     # duplicate in a set
+            [x for x in op('abbc', 'abcd', True)]   # but not in a multiset
+
+class SpillingSetOpTestCase(unittest.TestCase):
+    def test_same_as_in_memory(self):
+        r = ['x%i'%i for i in range(300)]
+        a = r[::2]
+        b = r[::3]
+        ma = list(abcdf_order1 * 10)
+        mb = list(abcdf_other_counts * 7)
+        for op in (SetIntersection, SetUnion, SetDifference, SetSymmetricDifference, SetJoin):
+            for memory_limit in (None, 0, 1000):
+                self.assertEqual(list(SpillingSetOp(op, a, b, memory_limit = memory_limit, partitions = 5)), list(op(a, b)))
+                self.assertEqual(list(SpillingSetOp(op, ma, mb, True, memory_limit = memory_limit, partitions = 5)),
+                                 list(op(ma, mb, True)))
+        key_a, key_b = (lambda x: int(x[1:])//2), (lambda y: int(y[1:])//3)
+        for left in (False, True):
+            self.assertEqual(list(SpillingSetOp(SetJoin, r, r, True, key_a, key_b, memory_limit = 0, left = left)),
+                             list(SetJoin(r, r, True, key_a, key_b, left = left)))
+
+    def test_partitions(self):
+        r = ['x%i'%i for i in range(3000)]
+        a, b = r[::2], r[::3]
+        ma = ['k'] * 500 + r[:100]  # a partition that cannot be split
+        for memory_limit, low, high in ((10000, 20, 40), (100000, 2, 5)):
+            # derived from the size of b (about 150 kB), known in advance or not
+            for bb in (b, iter(b)):
+                n = len(SpillingSetOp(SetIntersection, a, bb, memory_limit = memory_limit).b_parts)
+                self.assertTrue(low <= n <= high, n)
+        for op in (SetIntersection, SetUnion, SetDifference, SetSymmetricDifference, SetJoin):
+            # partitions of b too large for memory_limit partitioned again
+            self.assertEqual(list(SpillingSetOp(op, a, iter(b), memory_limit = 2000, partitions = 2)), list(op(a, b)))
+            self.assertEqual(list(SpillingSetOp(op, ma, ma, True, memory_limit = 2000)), list(op(ma, ma, True)))
+
+    def test_uniqueness_check(self):
+        r = list(range(100))
+        for op in (SetIntersection, SetUnion, SetDifference, SetSymmetricDifference, SetJoin):
+            c = SpillingSetOp(op, r+[0], r, memory_limit = 0)
+            with self.assertRaises(ValueError):
+                [x for x in c]
+            with self.assertRaises(ValueError):
+                [x for x in SpillingSetOp(op, r, r+[0], memory_limit = 0)]    # checked per partition once spilled
+            c = SpillingSetOp(op, r+[0], r+[0], True, memory_limit = 0)
+            [x for x in c]
+            with self.assertRaises(LookupError):
+                [x for x in c]
+
+class ParallelSetOpTestCase(unittest.TestCase):
+    def test_same_as_serial(self):
+        a = ['x%i'%i for i in range(0, 3000, 2)]
+        b = ['x%i'%i for i in range(0, 3000, 3)]
+        ma = list(abcdf_order1 * 10)
+        mb = list(abcdf_other_counts * 7)
+        for jobs in (1, 3):
+            for op in (SetIntersection, SetUnion, SetDifference, SetSymmetricDifference, SetJoin):
+                self.assertEqual(list(ParallelSetOp(op, a, b, jobs = jobs)), list(op(a, b)))
+                self.assertEqual(list(ParallelSetOp(op, ma, mb, True, jobs = jobs)), list(op(ma, mb, True)))
+            c = ParallelSetOp(SetJoin, a, b, True, (lambda x: x[:2]), (lambda y: y[:2]), jobs = jobs, left = True)
+            self.assertEqual(list(c), list(SetJoin(a, b, True, (lambda x: x[:2]), (lambda y: y[:2]), left = True)))
+            with self.assertRaises(LookupError):
+                [x for x in c]
+            with self.assertRaises(ValueError):
+                [x for x in ParallelSetOp(SetIntersection, a + a[:1], b, jobs = jobs)]
+
+    def test_line_files(self):
+        # read by byte ranges in the worker processes
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, name) for name in 'ab']
+            with open(paths[0], 'wb') as f:
+                f.write(b''.join(b'x%i\r\n'%i if i % 7 else b'x%i\r'%i for i in range(0, 3000, 2)) + b'last')
+            with open(paths[1], 'wb') as f:
+                f.write(b''.join(b'x%i\n'%i for i in range(0, 3000, 3)))
+            for encoding in (None, 'utf-8'):
+                a, b = (LineFile(path, encoding) for path in paths)
+                self.assertEqual(sum((a.lines(*r) for r in a.ranges(7)), []), list(a))
+                self.assertEqual(sum((a.lines(*r) for r in a.ranges(5000)), []), list(a))
+                for op in (SetIntersection, SetUnion, SetDifference, SetSymmetricDifference):
+                    self.assertEqual(list(ParallelSetOp(op, a, b, jobs = 3)), list(op(list(a), list(b))))
+
+    def test_chained(self):
+        # the inner operation runs (and finishes) before the outer one partitions its a
+        a = ['x%i'%i for i in range(0, 3000, 2)]
+        b = ['x%i'%i for i in range(0, 3000, 3)]
+        c = ['x%i'%i for i in range(0, 3000, 5)]
+        for jobs in (1, 3):
+            for op in (SetIntersection, SetUnion):
+                chained = ParallelSetOp(op, ParallelSetOp(op, a, b, jobs = jobs), c, jobs = jobs)
+                self.assertEqual(list(chained), list(op(op(a, b), c)))
+
+class NarySetOpTestCase(unittest.TestCase):
+    def chained(self, op, a, bs, m):
+        c = a
+        for b in bs:
+            c = op(c, b, m)
+        return list(c)
+
+    def test_same_as_chained(self):
+        for (op, nop) in ((SetIntersection, NarySetIntersection), (SetUnion, NarySetUnion)):
+            for m in (False, True):
+                for a in all_strings:
+                    for bs in ((abcdf_order1,), (alpha_nodups0, alpha_nodups1, ''), all_strings):
+                        try:
+                            d = self.chained(op, a, bs, m)
+                        except ValueError:
+                            with self.assertRaises(ValueError):
+                                list(nop(a, bs, m))
+                            continue
+                        c = nop(a, bs, m)
+                        self.assertEqual(list(c), d)
+                        with self.assertRaises(LookupError):
+                            [x for x in c]
+
+    def test_keys(self):
+        r = range(60)
+        bs = ([-x for x in r if x % 2 == 0], [-x for x in r if x % 3 == 0])
+        keys_b = (lambda y: -y, lambda y: -y)
+        self.assertEqual(list(NarySetIntersection(r, bs, keys_b = keys_b)), [x for x in r if x % 6 == 0])
+        self.assertEqual(list(NarySetUnion(r, bs, key_a = (lambda x: -x), keys_b = (None, None))), list(r))
+        with self.assertRaises(ValueError):
+            NarySetIntersection(r, bs, keys_b = keys_b[:1])
+
+class SetIndexTestCase(unittest.TestCase):
+    def test_probe_many(self):
+        for m in (False, True):
+            for b in all_strings:
+                if not m and len(set(b)) < len(b):
+                    with self.assertRaises(ValueError):
+                        SetIndex(b)
+                    continue
+                index = SetIndex(b, multiset = m)
+                for __ in range(2):
+                    for a in all_strings:
+                        if not m and len(set(a)) < len(a):
+                            continue
+                        for op in (SetIntersection, SetUnion, SetDifference, SetSymmetricDifference, SetJoin):
+                            self.assertEqual(list(op(a, index, m)), list(op(a, b, m)))
+
+    def test_keys(self):
+        r = range(100)
+        index = SetIndex(r, key_b = (lambda x: -x))
+        for __ in range(2):
+            self.assertEqual(list(SetIntersection(r, index, key_a = (lambda x: -x))), [(x, x) for x in r])
+            self.assertEqual(list(SetDifference(r, index)), [(x, None) for x in r if x != 0])
+            self.assertEqual(list(SetJoin(r, index, key_a = (lambda x: -2*x))), [(x, 2*x) for x in r if 2*x < 100])
+        index = SetIndex(r, key_b = (lambda x: x//2), multiset = True)
+        for left in (False, True):
+            self.assertEqual(list(SetJoin(r, index, True, left = left)), list(SetJoin(r, r, True, key_b = (lambda x: x//2), left = left)))
+        self.assertEqual(list(SetIntersection(r, index, True)), [(x, 2*x) for x in range(50)])
+        with self.assertRaises(ValueError):
+            SetIntersection(r, index)               # index of a multiset used for a set
+        with self.assertRaises(ValueError):
+            SetJoin(r, index, True, key_b = (lambda x: x))
+
+class DiskIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, lines):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines))
+        return path
+
+    def test_same_as_in_memory(self):
+        for m in (False, True):
+            for b in all_strings:
+                path = self.write('b', b)
+                DiskIndex.build(path)
+                if not m and len(set(b)) < len(b):
+                    with self.assertRaises(ValueError):
+                        DiskIndex(path, encoding = 'utf-8')
+                    continue
+                index = DiskIndex(path, multiset = m, encoding = 'utf-8')
+                b = [y+'\n' for y in b[:-1]] + [b[-1]] if b else []
+                for a in all_strings:
+                    if not m and len(set(a)) < len(a):
+                        continue
+                    a = [x+'\n' for x in a]
+                    for op in (SetIntersection, SetUnion, SetDifference, SetSymmetricDifference):
+                        self.assertEqual(
+                            [x.strip() for x in op(a, index, m)],
+                            list(op([x.strip() for x in a], [y.strip() for y in b], m))
+                            )
+                    self.assertEqual(
+                        [(x.strip(), y.strip()) for x, y in SetJoin(a, index, m)],
+                        list(SetJoin([x.strip() for x in a], [y.strip() for y in b], m))
+                        )
+
+    def test_many_copies(self):
+        b       = [y for i in range(300) for y in ('k', 'x%i'%i, 'k' if i % 3 else 'j')] + ['z']
+        path    = self.write('b', b)
+        DiskIndex.build(path)
+        index   = DiskIndex(path, multiset = True, encoding = 'utf-8')
+        b       = [y+'\n' for y in b[:-1]] + [b[-1]]
+        for a in (['k\n'] * 500 + ['j\n', 'x7\n', 'k\n'], ['j\n', 'k\n'] * 300):
+            for op in (SetIntersection, SetUnion, SetDifference, SetSymmetricDifference, SetJoin):
+                self.assertEqual(list(op(a, index, True)), list(op(a, b, True)))
+
+    def test_freshness(self):
+        path = self.write('b', alpha_nodups0)
+        self.assertFalse(DiskIndex.isFresh(path))
+        with self.assertRaises(ValueError):
+            DiskIndex(path)
+        DiskIndex.build(path)
+        self.assertTrue(DiskIndex.isFresh(path))
+        self.assertFalse(DiskIndex.isFresh(path, spec = b'2'))
+        self.assertEqual(list(SetIntersection([b'a\n', b'z\n'], DiskIndex(path))), [b'a\n'])
+        with open(path, 'a') as f:
+            f.write('\nz')
+        self.assertFalse(DiskIndex.isFresh(path))
+
+class BloomFilterTestCase(unittest.TestCase):
+    def test_approximate(self):
+        b       = ['%i\n'%i for i in range(0, 20000, 2)]
+        a       = ['%i\n'%i for i in range(20000)]
+        bloom   = BloomFilter(b, fp_rate = 0.01)
+        self.assertTrue(all(y in bloom for y in b))     # no false negatives
+        self.assertTrue(all(y.strip() in bloom for y in b))
+        false   = len(list(SetIntersection(a, bloom))) - len(b)
+        self.assertLess(false, 0.02 * len(b))
+        self.assertEqual(len(list(SetDifference(a, bloom))), len(a) - len(b) - false)
+        spilled = BloomFilter(iter(b), fp_rate = 0.01)     # hashes spilled in several blocks to size it
+        self.assertEqual((bloom.words, bloom.n), (spilled.words, spilled.n))
+        self.assertEqual(BloomFilter(iter(()), fp_rate = 0.01).n, 0)
+        self.assertLess(8 * len(bloom.words), 1.7 * len(b))
+        for op in (SetUnion, SetSymmetricDifference):
+            with self.assertRaises(ValueError):
+                op(a, bloom)
+        with self.assertRaises(ValueError):
+            SetIntersection(a, bloom, True)
+        with self.assertRaises(ValueError):
+            BloomFilter(b, fp_rate = 1)
+
+    def test_prefilter(self):
+        for m in (False, True):
+            for b in all_strings:
+                if not m and len(set(b)) < len(b):
+                    continue
+                index = BloomFilter(b, index = SetIndex(b, multiset = m))
+                for a in all_strings:
+                    if not m and len(set(a)) < len(a):
+                        continue
+                    for op in (SetIntersection, SetUnion, SetDifference, SetSymmetricDifference):
+                        self.assertEqual(list(op(a, index, m)), list(op(a, b, m)))
+                    self.assertEqual(list(SetJoin(a, index, m)), list(SetJoin(a, b, m)))
+
+    def test_save(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source  = os.path.join(directory, 'b')
+            with open(source, 'w') as f:
+                f.write('\n'.join(alpha_nodups0))
+            path    = BloomFilter.defaultPath(source)
+            bloom   = BloomFilter(open(source), key_b = str.strip)
+            self.assertFalse(BloomFilter.isFresh(source))
+            bloom.save(path, source, b'spec')
+            self.assertTrue(BloomFilter.isFresh(source, spec = b'spec'))
+            self.assertFalse(BloomFilter.isFresh(source))
+            loaded  = BloomFilter.load(path, source, b'spec')
+            self.assertEqual((loaded.words, loaded.hashes_n, loaded.n), (bloom.words, bloom.hashes_n, bloom.n))
+            self.assertEqual(list(SetIntersection(alpha_nodups1, loaded)), list(SetIntersection(alpha_nodups1, alpha_nodups0)))
+            with open(source, 'a') as f:
+                f.write('!')
+            with self.assertRaises(ValueError):
+                BloomFilter.load(path, source, b'spec')
+
+
+class DigestSetTestCase(unittest.TestCase):
+    def test_unique_check(self):
+        for size in (8, 16):
+            for a in all_strings:
+                for op in (SetIntersection, SetUnion, SetDifference, SetSymmetricDifference, SetJoin):
+                    if len(set(a)) < len(a):
+                        with self.assertRaises(ValueError):
+                            list(op(a, 'xa', unique_check = DigestSet(size)))
+                    else:
+                        self.assertEqual(list(op(a, 'xa', unique_check = DigestSet(size))), list(op(a, 'xa')))
+        with self.assertRaises(ValueError):
+            list(NarySetUnion('abca', ['x', 'y'], unique_check = DigestSet()))
+
+    def test_table(self):
+        keys    = ['line %i'%i for i in range(5000)]
+        d       = DigestSet(8)
+        for k in keys:
+            d.add(k)
+        self.assertEqual(len(d), len(keys))
+        self.assertTrue(all(k in d for k in keys))
+        self.assertFalse('line 5000' in d)
+        self.assertFalse(b'line 5000' in d)
+        self.assertTrue(b'line 4999\n' in d)
+        with self.assertRaises(ValueError):
+            d.add('line 0')
+        with self.assertRaises(ValueError):
+            DigestSet(4)
+
+    def test_reread(self):
+        # every 64-bit digest is confirmed by reading the keys again
+        reread  = []
+        d       = DigestSet(8, reread = lambda: reread.append(1) or iter('abc'))
+        d._digest = lambda kb: (1, 0)
+        for k in 'abc':
+            d.add(k)
+        self.assertEqual(len(reread), 3)
+        with self.assertRaises(ValueError):
+            d.add('b')
+
+    def test_limit(self):
+        d = DigestSet(limit = 3)
+        for k in 'abcabc':
+            d.add(k)
+        self.assertEqual(len(d), 3)
+
+    def test_index(self):
+        for b in all_strings:
+            if len(set(b)) < len(b):
+                with self.assertRaises(ValueError):
+                    DigestSetIndex(b)
+                continue
+            index = DigestSetIndex(b)
+            for a in all_strings:
+                if len(set(a)) == len(a):
+                    for op in (SetIntersection, SetDifference):
+                        self.assertEqual(list(op(a, index)), list(op(a, b)))
+            for op in (SetUnion, SetSymmetricDifference):
+                with self.assertRaises(ValueError):
+                    op('a', index)
+
+
+class BatchesTestCase(unittest.TestCase):
+    def test_same_as_iter(self):
+        for m in (False, True):
+            for a in all_strings:
+                for b in all_strings:
+                    for op in (SetIntersection, SetUnion, SetDifference, SetSymmetricDifference, SetJoin):
+                        for kwargs in ({}, {'key_a': str.upper, 'key_b': str.upper}, {'value_ab': lambda x, y: (y, x)}):
+                            for n in (1, 3, 1024):
+                                if not m and (len(set(a)) < len(a) or len(set(b)) < len(b)):
+                                    with self.assertRaises(ValueError):
+                                        list(op(a, b, m, **kwargs).iterBatches(n))
+                                    continue
+                                c = op(a, b, m, **kwargs)
+                                batches = list(c.iterBatches(n))
+                                self.assertTrue(all(0 < len(batch) <= n for batch in batches))
+                                self.assertEqual([x for batch in batches for x in batch], list(op(a, b, m, **kwargs)))
+                                with self.assertRaises(LookupError):
+                                    list(c.iterBatches(n))
+
+    def test_batches(self):
+        self.assertEqual(list(batches('abcde', 2)), [['a', 'b'], ['c', 'd'], ['e']])
+        self.assertEqual(list(batches('', 2)), [])
+
+
+class MultiplicityTestCase(unittest.TestCase):
+    def test_same_as_expanded(self):
+        for m in (False, True):
+            for a in all_strings:
+                for b in all_strings:
+                    if not m and (len(set(a)) < len(a) or len(set(b)) < len(b)):
+                        continue
+                    for kwargs in ({}, {'key_b': str.lower}, {'left': True}, {'build': 'a'}, {'b': SetIndex(b, multiset = m)}):
+                        kwargs  = dict({'b': b}, **kwargs)
+                        rows    = list(SetJoin(a, multiset = m, multiplicity = True, **kwargs))
+                        self.assertEqual([(x, y) for x, y, n in rows for __ in range(n)], list(SetJoin(a, multiset = m, **kwargs)))
+
+    def test_rows(self):
+        self.assertEqual(list(SetJoin('abxa', 'aacab', True, multiplicity = True)), [('a', 'a', 3), ('b', 'b', 1), ('a', 'a', 3)])
+        self.assertEqual(list(SetJoin('xa', 'aacab', True, multiplicity = True, left = True)), [('x', None, 1), ('a', 'a', 3)])
+        self.assertEqual(list(SetJoin('ab', 'aAba', True, key_a = str.lower, key_b = str.lower, multiplicity = True,
+                                      value_ab = lambda x, y, n: x + y * n)), ['aaa', 'aA', 'bb'])
+
+    def test_value_per_row(self):
+        # rows of the same key of b each of their own
+        rows = list(SetJoin('ab', 'aacab', True, value_ab = lambda x, y: [x, y]))
+        self.assertEqual(rows, [['a', 'a']] * 3 + [['b', 'b']])
+        rows[0].append('c')
+        self.assertEqual(rows[1], ['a', 'a'])
+
+
+class BuildSideTestCase(unittest.TestCase):
+    def test_same_as_build_b(self):
+        for m in (False, True):
+            for a in all_strings:
+                for b in all_strings:
+                    dup = not m and (len(set(a)) < len(a) or len(set(b)) < len(b))
+                    for op in (
+                        lambda a, b, build: SetIntersection(a, b, m, build = build),
+                        lambda a, b, build: SetIntersection(a, b, m, str.upper, str.upper, build = build),
+                        lambda a, b, build: SetJoin(a, b, m, build = build),
+                        lambda a, b, build: SetJoin(a, b, m, left = True, build = build),
+                        ):
+                        if dup:
+                            with self.assertRaises(ValueError):
+                                list(op(a, b, 'a'))
+                        else:
+                            self.assertEqual(list(op(a, b, 'a')), list(op(a, b, 'b')))
+
+    def test_auto(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = []
+            for name, lines in (('a', 'ba'), ('b', 'abcd')):
+                paths.append(os.path.join(directory, name))
+                with open(paths[-1], 'w') as f:
+                    f.write(''.join(x + '\n' for x in lines))
+            with open(paths[0]) as a, open(paths[1]) as b:
+                self.assertEqual(SetIntersection(a, b).build, 'b')  # the default
+            with open(paths[0]) as a, open(paths[1]) as b:
+                # a set b would be checked for uniqueness by digests
+                self.assertEqual(SetIntersection(a, b, build = 'auto').build, 'b')
+            with open(paths[0]) as a, open(paths[1]) as b:
+                c = SetIntersection(a, b, True, build = 'auto')
+                self.assertEqual(c.build, 'a')
+                self.assertEqual(list(c), ['b\n', 'a\n'])
+            with open(paths[1]) as a, open(paths[0]) as b:
+                self.assertEqual(SetIntersection(a, b, True, build = 'auto').build, 'b')
+        self.assertEqual(SetIntersection('ab', 'abcd', True, build = 'auto').build, 'b')
+        # hash(-1) == hash(-2), distinct keys nevertheless
+        self.assertEqual(list(SetIntersection([-1], [-1, -2], build = 'a')), [-1])
+        self.assertEqual(list(SetJoin([-2, 3], [-1, -2], left = True, build = 'a')), [(-2, -2), (3, None)])
+        with self.assertRaises(ValueError):
+            SetIntersection('ab', SetIndex('abcd'), build = 'a')
+        # unique_check of a honoured
+        for op in (SetIntersection, SetJoin):
+            with self.assertRaises(ValueError):
+                list(op('aba', 'ab', unique_check = DigestSet(16), build = 'a'))
+        self.assertEqual(list(SetIntersection('abab', 'ab', unique_check = DigestSet(16, limit = 2), build = 'a')),
+                         list('abab'))
+        self.assertEqual(list(SetJoin('abab', 'a', unique_check = DigestSet(16, limit = 2), build = 'a')),
+                         [('a', 'a'), ('a', 'a')])
+        with self.assertRaises(ValueError):
+            SetIntersection('ab', 'abcd', build = 'c')
+
+    def test_default_speed(self):
+        # a smaller file of a does not make the default slower than b as the build side (as the check of the
+        # uniqueness of b by digests would)
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, name) for name in 'ab']
+            for path, n in zip(paths, (100, 100000)):
+                with open(path, 'w') as f:
+                    f.write(''.join('%i\n'%i for i in range(n)))
+            seconds = {}
+            for build in ('b', None):
+                seconds[build] = float('inf')
+                for __ in range(3):
+                    with open(paths[0]) as a, open(paths[1]) as b:
+                        t = time.perf_counter()
+                        c = SetIntersection(a, b, **({'build': build} if build else {}))
+                        self.assertEqual(len(list(c)), 100)
+                        seconds[build] = min(seconds[build], time.perf_counter() - t)
+                self.assertEqual(c.build, 'b')
+            self.assertLess(seconds[None], 2 * seconds['b'])
+
+class ArraySetOpTestCase(unittest.TestCase):
+    ops = (SetIntersection, SetUnion, SetDifference, SetSymmetricDifference, SetJoin)
+
+    def assertSameAsOp(self, a, b, m, vectorized, ops = ops, **kwargs):
+        for op in ops:
+            c = ArraySetOp(op, a, b, m, **kwargs)
+            try:
+                expected = list(op(a, b, m, **kwargs))
+            except ValueError:
+                with self.assertRaises(ValueError):
+                    list(c)
+                continue
+            self.assertEqual(list(c), expected)
+            self.assertEqual(c.vectorized, vectorized and setop._importNumpy() is not None)
+            with self.assertRaises(LookupError):
+                list(c)
+
+    def test_same_as_op(self):
+        for m in (False, True):
+            for a in all_strings:
+                for b in all_strings:
+                    self.assertSameAsOp(a, b, m, bool(a or b))
+                    self.assertSameAsOp([ord(x) - 100 for x in a], [ord(x) - 100 for x in b], m, bool(a or b))
+                    self.assertSameAsOp(a, b, m, bool(a or b), key_a = str.upper, key_b = str.upper)
+                    self.assertSameAsOp(a, b, m, False, key_a = lambda x: x + 'é', key_b = lambda y: y + 'é')
+        self.assertSameAsOp('ab', 'bc', False, True, (SetJoin,), left = True)
+
+    def test_keys(self):
+        # long keys are compared as integers, unless they are not canonical
+        for a, b, vectorized in (
+            (['1234567890', '-987654321', '5'],     ['5', '-987654321', '1234567891'],  True),
+            (['1234567890', '0000000005', '5'],     ['5', '1234567890'],                False),
+            (['1234567890', 'abcdefghij'],          ['abcdefghij'],                     False),
+            ([b'1234567890', b'-5'],                [b'-5', b'1234567890'],             True),
+            (['x\0', 'x'],                          ['x'],                              False),
+            ):
+            self.assertSameAsOp(a, b, False, vectorized)
+        c = ArraySetOp(SetIntersection, ['1\tx\n', '2\ty\n'], ['2\tz\n'], key_a = fieldKey(0), key_b = fieldKey(0),
+                       value_ab = lambda x, y: x + y)
+        self.assertEqual(list(c.iterBatches(1)), [['2\ty\n2\tz\n']])
+
+    def test_fallback(self):
+        numpy, setop.numpy = setop._importNumpy(), None
+        try:
+            c = ArraySetOp(SetDifference, [1, 2, 3], [2])
+            self.assertEqual(list(c), [1, 3])
+            self.assertFalse(c.vectorized)
+        finally:
+            setop.numpy = numpy
+        self.assertEqual(list(ArraySetOp(SetIntersection, 'abc', SetIndex('cb'))), ['b', 'c'])
+        self.assertEqual(list(ArraySetOp(SetJoin, 'aab', 'aa', True, multiplicity = True)), [('a', 'a', 2)] * 2)
+
+
+class StatsTestCase(unittest.TestCase):
+    def test_tableSizes(self):
+        self.assertEqual(SetIntersection('abc', 'bcd').tableSizes(), {'b': 3, 'a': 0})
+        c = SetDifference('abc', 'bcd')
+        list(c)
+        self.assertEqual(c.tableSizes(), {'b': 3, 'a': 3})
+        self.assertEqual(SetUnion('aab', 'abbb', True).tableSizes(), {'b': 2})
+        self.assertEqual(SortedSetUnion('ab', 'bc').tableSizes(), {})
+        # only the tables of the chosen strategy
+        for c in (SetIntersection('abc', 'bcd', build = 'a'), SetJoin('abc', 'bcd', build = 'a')):
+            self.assertEqual(c.tableSizes(), {})
+            list(c)
+            self.assertEqual(c.tableSizes(), {'a': 3, 'b': 3})
+        c = SetJoin('abc', 'bcdd', True, build = 'a')
+        list(c)
+        self.assertEqual(c.tableSizes(), {'a': 3})
+        c = NarySetUnion('abc', ['bcd', 'x'])
+        self.assertEqual(c.tableSizes(), {})
+        list(c)
+        self.assertEqual(c.tableSizes(), {'inputs': 5})
+
+    def test_steps(self):
+        for op, n, hits in (
+            (SetIntersection,           1, 1),
+            (SetDifference,             2, 1),
+            (SetUnion,                  6, 1),
+            (SetSymmetricDifference,    5, 1),
+            (SortedSetUnion,            6, 1),
+            (NarySetIntersection,       1, 1),
+            (NarySetUnion,              6, 3),
+            ):
+            stats   = SetStats()
+            a       = stats.input('A', 'abc')
+            if issubclass(op, NarySetOp):
+                b   = [stats.input('B1', 'cdxx'), stats.input('B2', 'cx')]
+            else:
+                b   = stats.input('B', 'cdxx')
+            with stats.timed('build'):
+                c   = op(a, b, True)
+            stats.step('step 1', op, c, 'A', ['B1', 'B2'] if issubclass(op, NarySetOp) else 'B', 'output')
+            with stats.timed('probe'):
+                stats.add('output', len(list(c)))
+            r = stats.report()
+            self.assertEqual(r['items']['output'], n)
+            self.assertEqual(r['steps'][0]['hits'], hits)
+            self.assertEqual(set(r['seconds']), {'build', 'probe', 'total'})
+            self.assertEqual(r['steps'][0]['misses'], 6 if op == NarySetUnion else 2)
+            if op == SetIntersection:
+                self.assertEqual(r['steps'][0]['duplicates_b'], 1)
+                self.assertEqual(r['steps'][0]['table_sizes'], {'b': 3})
+            self.assertEqual(len(stats.text()), 3 + (stats.report()['peak_memory'] is not None))
+            self.assertEqual(json.loads(stats.json())['items'], r['items'])
+
+    def test_counted_on_error(self):
+        stats = SetStats()
+        with self.assertRaises(ValueError):
+            list(SetIntersection(stats.input('A', 'aba'), 'a'))
+        self.assertEqual(stats.report()['items'], {'A': 3})
+
+
+class CountAnyTestCase(unittest.TestCase):
+    def test_same_as_iter(self):
+        for m in (False, True):
+            for a in all_strings:
+                for b in all_strings:
+                    if not m and (len(set(a)) < len(a) or len(set(b)) < len(b)):
+                        continue
+                    for op in (
+                        lambda a, b: SetIntersection(a, b, m),
+                        lambda a, b: SetIntersection(a, b, m, str.upper, str.upper),
+                        lambda a, b: SetIntersection(a, SetIndex(b, multiset = m), m),
+                        lambda a, b: SetIntersection(a, b, m, build = 'a'),
+                        lambda a, b: SetUnion(a, b, m),
+                        lambda a, b: SetDifference(a, b, m),
+                        lambda a, b: SetDifference(a, b, m, str.upper, str.upper),
+                        lambda a, b: SetSymmetricDifference(a, b, m),
+                        lambda a, b: SetJoin(a, b, m),
+                        lambda a, b: SetJoin(a, b, m, left = True),
+                        lambda a, b: SetJoin(a, b, m, str.upper, left = True),
+                        lambda a, b: SetJoin(a, b, m, multiplicity = True),
+                        lambda a, b: SortedSetUnion(sorted(a), sorted(b), m),
+                        lambda a, b: NarySetIntersection(a, [b, b[::-1]], m),
+                        ):
+                        n = len(list(op(a, b)))
+                        self.assertEqual(op(a, b).count(), n)
+                        self.assertEqual(op(a, b).any(), n > 0)
+                        c = op(a, b)
+                        c.count()
+                        with self.assertRaises(LookupError):
+                            list(c)
+
+    def test_short_circuit(self):
+        read = []
+        def a():
+            for x in 'xbcb':
+                read.append(x)
+                yield x
+        c = SetIntersection(a(), 'abc')
+        self.assertTrue(c.any())
+        self.assertEqual(read, ['x', 'b'])
+        with self.assertRaises(LookupError):
+            c.any()
+        self.assertFalse(SetDifference('ab', 'abc').any())
+        with self.assertRaises(ValueError):
+            SetIntersection('xbcb', 'abc').count()
+
+class IncrementalSetOpTestCase(unittest.TestCase):
+    def test_same_as_op(self):
+        for m in (False, True):
+            for a in all_strings:
+                for b in all_strings:
+                    if not m and (len(set(a)) < len(a) or len(set(b)) < len(b)):
+                        continue
+                    for op, kwargs in ((SetIntersection, {}), (SetUnion, {}), (SetDifference, {}),
+                                       (SetSymmetricDifference, {}), (SetJoin, {'left': True})):
+                        c = IncrementalSetOp(op, SetIndex(b, multiset = m), m, **kwargs)
+                        results = [x for i in range(0, len(a), 3) for x in c.feed(a[i:i+3])] + c.finish()
+                        self.assertEqual(results, list(op(a, b, m, **kwargs)))
+
+    def test_unique_across_batches(self):
+        c = IncrementalSetOp(SetDifference, SetIndex('ab'))
+        self.assertEqual(c.feed('xa'), ['x'])
+        c.replace(SetIndex('xy'))
+        self.assertEqual(c.feed('by'), ['b'])
+        with self.assertRaises(ValueError):
+            c.feed('cx')
+        with self.assertRaises(ValueError):
+            c.replace(SetIndex('ab', multiset = True))
+        with self.assertRaises(ValueError):
+            IncrementalSetOp(SortedSetIntersection, SetIndex('ab'))
+
+    def test_replace_multiset(self):
+        c = IncrementalSetOp(SetIntersection, SetIndex('aab', multiset = True), True)
+        self.assertEqual(c.feed('aa'), ['a', 'a'])
+        self.assertEqual(c.feed('ab'), ['b'])
+        c.replace(SetIndex('a', multiset = True))
+        self.assertEqual(c.feed('aa'), ['a'])
+
+class ServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory  = tempfile.TemporaryDirectory()
+        d               = self.directory.name
+        self.socket     = os.path.join(d, 'socket')
+        self.paths      = {}
+        for name, lines in (('b', 'bcdx'), ('m', abcdf_order1), ('d', 'abca')):
+            self.paths[name] = os.path.join(d, name)
+            with open(self.paths[name], 'w') as f:
+                f.write(''.join('%s\t%i\n'%(x, i) for i, x in enumerate(lines)))
+        server = SetServer([0])
+        server.load('b', self.paths['b'])
+        with self.assertRaises(ValueError):
+            server.load('d', self.paths['d'])   # duplicates in b
+        threading.Thread(target = server.run, args = (self.socket,), daemon = True).start()
+        while not os.path.exists(self.socket):
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def query(self, op, a, **request):
+        request = dict({'op': op, 'set': 'b', 'fields': [0], 'fields_b': [0]}, **request)
+        return b''.join(SetClient(self.socket, request).results([a[:3], a[3:]])).splitlines()
+
+    def test_ops(self):
+        a = b'a\t0\nc\t1\nx\t2'
+        self.assertEqual(self.query('intersection', a), [b'c\t1', b'x\t2'])
+        self.assertEqual(self.query('difference', a), [b'a\t0'])
+        self.assertEqual(self.query('union', a), [b'a\t0', b'c\t1', b'x\t2', b'b\t0', b'd\t2'])
+        self.assertEqual(self.query('symmetric-difference', a), [b'a\t0', b'b\t0', b'd\t2'])
+        self.assertEqual(self.query('join', a, left = True), [b'a\t0', b'c\t1\tc\t1', b'x\t2\tx\t3'])
+        self.assertEqual(self.query('intersection', b'c\nz\n', fields = None, path = os.path.realpath(self.paths['b'])),
+                         [b'c'])
+        self.assertEqual(self.query('intersection', b''), [])
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            self.query('intersection', b'a\t0\na\t1\n')
+        with self.assertRaises(ValueError):
+            self.query('sum', b'a\n')
+        for request in ({'set': 'd'}, {'path': self.paths['m']}, {'multiset': True}, {'fields_b': None}):
+            with self.assertRaises(LookupError):
+                self.query('intersection', b'a\n', **request)
+        with self.assertRaises(OSError):
+            SetClient(os.path.join(self.directory.name, 'none'), {})
+
+    def test_idle_clients(self):
+        # more clients waiting to send a than the threads of the default executor, the others still served
+        idle = [SetClient(self.socket, {'op': 'intersection', 'set': 'b', 'fields': [0], 'fields_b': [0]})
+                for __ in range(40)]
+        try:
+            results = []
+            thread  = threading.Thread(target = lambda: results.append(self.query('union', b'x\t0\n')), daemon = True)
+            thread.start()
+            thread.join(10)
+            self.assertEqual(results, [[b'x\t0', b'b\t0', b'c\t1', b'd\t2']])
+        finally:
+            for c in idle:
+                c.close()
+
+    def test_reload(self):
+        path = os.path.realpath(self.paths['b'])
+        self.assertEqual(self.query('intersection', b'a\n', path = path), [])
+        with open(path, 'w') as f:
+            f.write('a\t9\n')
+        os.utime(path, ns = (0, 0))
+        self.assertEqual(self.query('intersection', b'a\n', path = path), [b'a'])
+        self.assertEqual(self.query('union', b'', path = path), [b'a\t9'])
+
+class AggregateTestCase(unittest.TestCase):
+    def test_methods(self):
+        items = [('b', 1), ('a', 2), ('b', 3), ('b', 1), ('c', 0)]
+        key, value = itemgetter(0), itemgetter(1)
+        for method, d in (
+            ('count',               [('b', 3), ('a', 1), ('c', 1)]),
+            ('list',                [('b', [1, 3, 1]), ('a', [2]), ('c', [0])]),
+            ('count-list',          [('b', (3, [1, 3, 1])), ('a', (1, [2])), ('c', (1, [0]))]),
+            ('count-count-list',    [('b', (3, [(1, 2), (3, 1)])), ('a', (1, [(2, 1)])), ('c', (1, [(0, 1)]))]),
+            ):
+            c = HashAggregate(items, key, value, method)
+            self.assertEqual(list(c), d)
+            with self.assertRaises(LookupError):
+                [x for x in c]
+            s = sorted(items, key = key)
+            self.assertEqual(list(SortedAggregate(s, key, value, method)), sorted(d))
+            with self.assertRaises(ValueError):
+                list(SortedAggregate(items, key, value, method))
+        with self.assertRaises(ValueError):
+            HashAggregate(items, method = 'sum')
+
+    def test_as_set(self):
+        a = HashAggregate(abcdf_order1)
+        b = SortedAggregate(sorted(xyzuv + 'c'))
+        self.assertEqual(list(SetIntersection(a, b, key_a = itemgetter(0), key_b = itemgetter(0))),
+                         [(('c', 3), ('c', 1))])
+
+
+class TsetopTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def command(self, *args):
+        return [sys.executable, '-W', 'always::ResourceWarning',
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tsetop')] + list(args)
+
+    def tsetop(self, *args):
+        # its output, checked for files left to the garbage collector
+        p = subprocess.run(self.command(*args), stdout = subprocess.PIPE, stderr = subprocess.PIPE, check = True,
+                           cwd = self.directory.name)
+        self.assertEqual(p.stderr, b'')
+        return p.stdout
+
+    def test_follow_pipe(self):
+        # results written while A is a pipe that stays open
+        with open(os.path.join(self.directory.name, 'b'), 'w') as f:
+            f.write('y\n')
+        p = subprocess.Popen(self.command('--follow', '-D', '-', 'b'), stdin = subprocess.PIPE,
+                             stdout = subprocess.PIPE, cwd = self.directory.name)
+        try:
+            p.stdin.write(b'x\ny\n')
+            p.stdin.flush()
+            self.assertTrue(select.select([p.stdout], [], [], 10)[0])
+            self.assertEqual(p.stdout.readline(), b'x\n')
+        finally:
+            p.stdin.close()
+            self.assertEqual(p.wait(10), 0)
+            p.stdout.close()
+
+    def test_index_missing_field(self):
+        with open(os.path.join(self.directory.name, 'b'), 'wb') as f:
+            f.write(b'a\tb\nc\n')
+        p = subprocess.run(self.command('index', '-f', '2', 'b'), stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+                           cwd = self.directory.name)
+        self.assertEqual((p.returncode, p.stderr), (1, b"tsetop: Error: Line b'c\\n' has no field 2 (separated by b'\\t').\n"))
+        self.assertEqual(os.listdir(self.directory.name), ['b'])
+
+    def test_index_crlf(self):
+        # the same results with and without the index of a B file with \r\n line ends
+        for name, data in (('a', b'a\r\nb\r\n'), ('b', b'b\r\nc\r\n')):
+            with open(os.path.join(self.directory.name, name), 'wb') as f:
+                f.write(data)
+        runs = [('-I', 'a', 'b'), ('-U', 'a', 'b'), ('-D', 'a', 'b'), ('--approximate', '-I', 'a', 'b')]
+        expected = [self.tsetop(*run) for run in runs]
+        self.assertEqual(expected[:3], [b'b\n', b'a\nb\nc\n', b'a\n'])
+        self.tsetop('index', '--bloom', 'b')
+        self.assertEqual([self.tsetop(*run) for run in runs], expected)
+        self.assertEqual(self.tsetop('-b', '-I', 'a', 'b'), b'b\r\n')
+
+    def test_binary(self):
+        # the same output as in text mode for memory-mapped regular files, stdin, empty and compressed files
+        data = {'a': b'x1\nx2\nx3\n', 'b': b'x2\nx4\n', 'e': b'', 'n': b'x4\nx5'}
+        for name, lines in data.items():
+            with open(os.path.join(self.directory.name, name), 'wb') as f:
+                f.write(lines)
+            with gzip.open(os.path.join(self.directory.name, name + '.gz'), 'wb') as f:
+                f.write(lines)
+        def run(*args, stdin = b''):
+            p = subprocess.run(self.command(*args), input = stdin, stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+                               check = True, cwd = self.directory.name)
+            self.assertEqual(p.stderr, b'')
+            return p.stdout
+        for op in ('-I', '-U', '-D', '-S'):
+            for files, stdin in (
+                (('a', 'b'), b''), (('-', 'b'), data['a']), (('a', '-'), data['b']), (('a', 'e'), b''),
+                (('e', 'b'), b''), (('e', 'e'), b''), (('n', 'a'), b''), (('a.gz', 'b.gz'), b''),
+                (('e.gz', 'n.gz'), b''),
+                ):
+                self.assertEqual(run('-b', op, *files, stdin = stdin), run(op, *files, stdin = stdin))
+            self.assertEqual(run('-b', op, 'a', 'b'), {
+                '-I': b'x2\n', '-U': b'x1\nx2\nx3\nx4\n', '-D': b'x1\nx3\n', '-S': b'x1\nx3\nx4\n'}[op])
+
+    def test_short_pipe(self):
+        # the compression of stdin recognized even if its first read returns less than the magic
+        with open(os.path.join(self.directory.name, 'b'), 'wb') as f:
+            f.write(b'x2\nx4\n')
+        a = b'x1\nx2\nx3\n'
+        for options in ([], ['-b']):
+            for stdin in (lzma.compress(a), bz2.compress(a), gzip.compress(a), a):
+                p = subprocess.Popen(self.command(*options, '-I', '-', 'b'), stdin = subprocess.PIPE,
+                                     stdout = subprocess.PIPE, cwd = self.directory.name)
+                p.stdin.write(stdin[:2])
+                p.stdin.flush()
+                time.sleep(0.2)
+                out, __ = p.communicate(stdin[2:], timeout = 10)
+                self.assertEqual((p.returncode, out), (0, b'x2\n'))
+
+    def test_jobs(self):
+        # the same output as the serial run, with regular files read by the worker processes and stdin by tsetop
+        with open(os.path.join(self.directory.name, 'a'), 'wb') as f:
+            f.write(b''.join(b'x%i\r\n'%i for i in range(0, 3000, 2)))
+        b = b''.join(b'x%i\n'%i for i in range(0, 3000, 3))
+        with open(os.path.join(self.directory.name, 'b'), 'wb') as f:
+            f.write(b)
+        for options in ([], ['-b']):
+            for op in ('-I', '-U', '-D', '-S'):
+                expected = self.tsetop(*options, op, 'a', 'b')
+                self.assertEqual(self.tsetop(*options, '-j', '3', op, 'a', 'b'), expected)
+                p = subprocess.run(self.command(*options, '-j', '3', op, 'a', '-'), input = b, stdout = subprocess.PIPE,
+                                   check = True, cwd = self.directory.name)
+                self.assertEqual(p.stdout, expected)
+
+    def test_serve_stop(self):
+        # stopped by SIGTERM with connections open, without tracebacks and removing the socket
+        with open(os.path.join(self.directory.name, 'b'), 'wb') as f:
+            f.write(b'x\n')
+        socket = os.path.join(self.directory.name, 'socket')
+        p = subprocess.Popen(self.command('serve', '-S', socket, 'b'), stderr = subprocess.PIPE,
+                             cwd = self.directory.name)
+        try:
+            while not os.path.exists(socket):
+                time.sleep(0.01)
+            idle = [SetClient(socket, {'op': 'intersection', 'set': 'b'}) for __ in range(3)]
+            self.assertEqual(b''.join(SetClient(socket, {'op': 'intersection', 'set': 'b'}).results([b'x\ny\n'])),
+                             b'x\n')
+            p.terminate()
+            self.assertEqual(p.wait(10), 0)
+            self.assertEqual(p.stderr.read(), b'')
+            self.assertFalse(os.path.exists(socket))
+            for c in idle:
+                c.close()
+        finally:
+            if p.poll() is None:
+                p.kill()
+                p.wait()
+            p.stderr.close()
+
+    def test_compression(self):
+        a = b''.join(b'x%i\n'%i for i in range(0, 3000, 2))
+        b = b''.join(b'x%i\n'%i for i in range(0, 3000, 3))
+        i = b''.join(b'x%i\n'%i for i in range(0, 3000, 6))
+        for options in ([], ['-b'], ['--no-threads']):
+            for module, extension in ((gzip, '.gz'), (bz2, '.bz2'), (lzma, '.xz')):
+                with module.open(os.path.join(self.directory.name, 'a' + extension), 'wb') as f:
+                    f.write(a)
+                with module.open(os.path.join(self.directory.name, 'b' + extension), 'wb') as f:
+                    f.write(b)
+                # compressed by the extension of the output file
+                self.tsetop(*options, '-I', 'a' + extension, 'b' + extension, '-o', 'i' + extension)
+                with module.open(os.path.join(self.directory.name, 'i' + extension), 'rb') as f:
+                    self.assertEqual(f.read(), i)
+            for name, module in (('gzip', gzip), ('bz2', bz2), ('xz', lzma)):
+                self.assertEqual(module.decompress(self.tsetop(*options, '-z', name, '-I', 'a.gz', 'b.xz')), i)
+
 
 if __name__ == '__main__':
     unittest.main()